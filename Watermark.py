@@ -1,6 +1,8 @@
-from PIL import Image, ImageEnhance
+from PIL import Image
 import os
 
+from overlays import OverlayCache
+
 def apply_watermark(opacity=1.0, header_margin=20, header_top_margin=10):
     # Define directory paths
     wm_dir = 'WM'
@@ -18,15 +20,12 @@ def apply_watermark(opacity=1.0, header_margin=20, header_top_margin=10):
         return
 
     watermark = Image.open(watermark_path).convert("RGBA")
-    watermark_width, watermark_height = watermark.size
-
-    # Adjust watermark opacity
-    if 0 <= opacity <= 1:
-        alpha = watermark.split()[3]
-        alpha = ImageEnhance.Brightness(alpha).enhance(opacity)
-        watermark.putalpha(alpha)
-    else:
+    overlay_cache = OverlayCache()
+
+    # Watermark opacity is applied by the cache after resizing
+    if not 0 <= opacity <= 1:
         print("Opacity must be between 0 and 1. Using default opacity of 1.0.")
+        opacity = 1.0
 
     # Process images in RAW directory
     for raw_image_name in os.listdir(raw_dir):
@@ -36,14 +35,14 @@ def apply_watermark(opacity=1.0, header_margin=20, header_top_margin=10):
             continue
 
         try:
-            # Open the raw image
-            raw_image = Image.open(raw_image_path).convert("RGBA")
+            # Open the raw image (saved as JPEG, so its alpha would be dropped anyway)
+            raw_image = Image.open(raw_image_path).convert("RGB")
             raw_width, raw_height = raw_image.size
 
-            # Resize watermark to match the width of the raw image
-            scale_factor = raw_width / watermark_width
-            resized_wm_height = int(watermark_height * scale_factor)
-            resized_watermark = watermark.resize((raw_width, resized_wm_height), Image.Resampling.LANCZOS)
+            # Resize watermark to match the width of the raw image (reused across same-width images);
+            # premultiplied so pasting onto the RGB image skips a multiply per pixel
+            resized_watermark = overlay_cache.scaled(watermark, raw_width, (header_margin, header_top_margin),
+                                                     opacity=opacity, premultiplied=True)
 
             # Paste the watermark on the raw image
             # Calculate the watermark position
@@ -55,7 +54,7 @@ def apply_watermark(opacity=1.0, header_margin=20, header_top_margin=10):
 
             # Save the final image
             final_image_path = os.path.join(done_dir, raw_image_name)
-            raw_image.convert("RGB").save(final_image_path, "JPEG")
+            raw_image.save(final_image_path, "JPEG")
             print(f"Processed and moved: {raw_image_name}")
 
             # Remove the original image from RAW
@@ -64,6 +63,8 @@ def apply_watermark(opacity=1.0, header_margin=20, header_top_margin=10):
         except Exception as e:
             print(f"Failed to process {raw_image_name}: {e}")
 
+    print(f"Watermark cache: {overlay_cache.hits} hits / {overlay_cache.misses} misses")
+
 if __name__ == "__main__":
     # Example usage: Change opacity, header margin, and header top margin as needed
     apply_watermark(opacity=0.5, header_margin=30, header_top_margin=10)
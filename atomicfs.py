@@ -0,0 +1,72 @@
+"""Crash-safe file commits: write or copy to a hidden temporary file, fsync, then rename into place.
+
+A reader of the destination folder only ever sees a missing file or a complete
+one, never a truncated output left behind by a crash or a full disk. Temporary
+files live next to their destination, so the final rename never crosses a
+filesystem.
+"""
+import os
+import errno
+import shutil
+import uuid
+
+
+def temp_path(path):
+    """Hidden, unique temporary name in path's folder"""
+    folder, name = os.path.split(path)
+    return os.path.join(folder, f".{name}.{uuid.uuid4().hex[:8]}.part")
+
+
+def _sync(handle):
+    handle.flush()
+    os.fsync(handle.fileno())
+
+
+def write_atomic(path, data):
+    """Write data to path so the file appears complete or not at all"""
+    temporary = temp_path(path)
+    try:
+        with open(temporary, 'wb') as output:
+            output.write(data)
+            _sync(output)
+        os.replace(temporary, path)
+    except BaseException:
+        _discard(temporary)
+        raise
+
+
+def copy_atomic(source, path):
+    """Copy source to path (data and timestamps) so the copy appears complete or not at all"""
+    temporary = temp_path(path)
+    try:
+        with open(source, 'rb') as original, open(temporary, 'wb') as output:
+            shutil.copyfileobj(original, output, 1024 * 1024)
+            _sync(output)
+        shutil.copystat(source, temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        _discard(temporary)
+        raise
+
+
+def move_file(source, path):
+    """Move source to path: a rename on the same filesystem, else an atomic copy then delete.
+
+    Returns "renamed" or "copied".
+    """
+    try:
+        os.replace(source, path)
+        return "renamed"
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    copy_atomic(source, path)
+    os.remove(source)
+    return "copied"
+
+
+def _discard(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,317 @@
+"""Reproducible benchmark of the compositing and encoding hot paths.
+
+Synthesizes a corpus (12MP JPEG, 50MP TIFF, RGBA PNG, animated GIF) plus overlay
+assets, then times each stage of the engine per image and reports images/sec,
+MB/s of source data, p50/p99 latency and peak RSS. Results are printed as a table
+and can be written as JSON and compared against an earlier run:
+
+    python benchmark.py --json before.json
+    python benchmark.py --json after.json --compare before.json
+
+--blend numpy times the optional NumPy compositor (npblend) in place of the
+engine's Pillow one; it is not a job setting, only this benchmark selects it.
+--verify checks that it reproduces the Pillow compositor bit for bit on every
+corpus image before anything is timed.
+"""
+from PIL import Image, ImageDraw
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from pathlib import Path
+from contextlib import contextmanager
+from dataclasses import replace
+
+import PIL
+import engine
+import npblend
+from engine import WatermarkJob
+
+
+# name -> (file name, size in pixels, mode, Pillow format, extra save arguments)
+CORPUS = {
+    "jpeg-12mp": ("photo.jpg", (4000, 3000), "RGB", "JPEG", {'quality': 92}),
+    "tiff-50mp": ("scan.tiff", (8660, 5774), "RGB", "TIFF", {}),
+    "png-rgba": ("graphic.png", (3000, 2000), "RGBA", "PNG", {}),
+    "gif-animated": ("loop.gif", (800, 600), "P", "GIF", {}),
+}
+
+STAGES = ("decode", "opacity", "composite", "text", "encode", "total")
+
+# Compositors for RGB bases; both produce identical pixels, "numpy" needs NumPy installed
+BLEND_BACKENDS = ("pillow", "numpy")
+
+
+def _scene(size, seed):
+    """Deterministic photo-like content: smooth gradients with grain and detail"""
+    width, height = size
+    base = Image.linear_gradient("L").resize(size)
+    grain = Image.effect_noise(size, 24 + seed)
+    detail = Image.effect_mandelbrot(size, (-2.2 + seed * 0.01, -1.2, 1.0, 1.2), 64)
+    return Image.merge("RGB", (base, grain, detail))
+
+
+def build_corpus(directory, scale=1.0):
+    """Write the benchmark images and overlay assets into directory (reused when present)"""
+    os.makedirs(directory, exist_ok=True)
+    paths = {}
+    for seed, (name, (file_name, size, mode, image_format, save_args)) in enumerate(CORPUS.items()):
+        path = os.path.join(directory, file_name)
+        paths[name] = path
+        scaled = (max(64, int(size[0] * scale)), max(64, int(size[1] * scale)))
+        if os.path.exists(path) and Image.open(path).size == scaled:
+            continue
+
+        scene = _scene(scaled, seed)
+        if image_format == "GIF":
+            frames = [scene.rotate(angle).convert("P", palette=Image.Palette.ADAPTIVE) for angle in range(0, 40, 4)]
+            frames[0].save(path, "GIF", save_all=True, append_images=frames[1:], duration=80, loop=0)
+        elif mode == "RGBA":
+            scene.putalpha(Image.linear_gradient("L").rotate(90).resize(scaled))
+            scene.save(path, image_format, **save_args)
+        else:
+            scene.convert(mode).save(path, image_format, **save_args)
+
+    assets = {}
+    for asset, size in (("watermark", (1200, 400)), ("header", (2400, 240)), ("footer", (2400, 200))):
+        path = os.path.join(directory, f"{asset}.png")
+        assets[asset] = path
+        if not os.path.exists(path):
+            overlay = Image.new("RGBA", size, (0, 0, 0, 0))
+            draw = ImageDraw.Draw(overlay)
+            draw.rounded_rectangle((0, 0, size[0] - 1, size[1] - 1), radius=size[1] // 4,
+                                   fill=(20, 40, 120, 180), outline=(255, 255, 255, 230), width=6)
+            draw.text((size[1] // 3, size[1] // 3), f"{asset.upper()} SAMPLE", fill=(255, 255, 255, 255))
+            overlay.save(path)
+    return paths, assets
+
+
+def _rss_bytes():
+    """Peak resident set size since the last reset; 0 where it cannot be measured"""
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        # Windows has no resource module; psutil reports the peak working set when it is installed
+        try:
+            import psutil
+        except ImportError:
+            return 0
+        return getattr(psutil.Process().memory_info(), 'peak_wset', 0)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _reset_peak_rss():
+    """Reset the peak RSS counter where the kernel allows it (Linux); otherwise peaks are cumulative"""
+    try:
+        with open("/proc/self/clear_refs", "w") as clear_refs:
+            clear_refs.write("5")
+    except OSError:
+        pass
+
+
+def _percentile(samples, fraction):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def measure(stage, corpus, source_bytes, repeat, run):
+    """Time run() repeat times after one warm-up call and summarize"""
+    run()
+    _reset_peak_rss()
+    latencies = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        run()
+        latencies.append(time.perf_counter() - started)
+
+    elapsed = sum(latencies)
+    return {
+        'corpus': corpus,
+        'stage': stage,
+        'images': repeat,
+        'images_per_sec': round(repeat / elapsed, 3),
+        'mb_per_sec': round(source_bytes * repeat / elapsed / 1024 ** 2, 3),
+        'p50_ms': round(_percentile(latencies, 0.50) * 1000, 3),
+        'p99_ms': round(_percentile(latencies, 0.99) * 1000, 3),
+        'peak_rss_mb': round(_rss_bytes() / 1024 ** 2, 1),
+    }
+
+
+def render_all(path, image_file, plan, watermark, header, footer, job, overlay_cache, encoder):
+    """Render and encode every profile of one image the way a pool worker does"""
+    if plan.frames > 1:
+        return [engine.encode_frames(frames, plan.output_format, encoder, **timing)
+                for _, frames, timing in engine.render_frames(path, watermark, header, footer, job, overlay_cache)]
+    return [engine.encode_output(image, image_file, encoder, plan.output_format)
+            for _, image in engine.render_profiles(path, watermark, header, footer, job, overlay_cache)]
+
+
+def benchmark_image(corpus, path, job, overlays, repeat):
+    """Measure every stage for one corpus image"""
+    watermark, header, footer = overlays
+    raw_watermark = engine.load_asset(job.watermark_path)
+    source_bytes = os.path.getsize(path)
+    image_file = Path(path).name
+    plain_job = replace(job, add_text=False)
+    encoder = job.encoder_profile()
+    plan = engine.plan_source(path, job)
+    # Warm per-worker caches, as in a real batch after the first image
+    overlay_cache = engine.OverlayCache()
+    decoded = engine.native_base(Image.open(path))
+    composited = engine.apply_overlays(decoded.copy(), watermark, header, footer, plain_job)
+
+    stages = {
+        "decode": lambda: engine.native_base(Image.open(path)),
+        "opacity": lambda: engine.apply_opacity(raw_watermark, job.opacity / 100.0),
+        "composite": lambda: engine.apply_overlays(decoded.copy(), watermark, header, footer, plain_job,
+                                                   overlay_cache),
+        "text": lambda: engine.add_styled_text(decoded.copy(), job, overlay_cache),
+        "encode": lambda: engine.encode_output(composited, image_file, encoder),
+        "total": lambda: render_all(path, image_file, plan, watermark, header, footer, job, overlay_cache, encoder),
+    }
+    return [measure(stage, corpus, source_bytes, repeat, stages[stage]) for stage in STAGES]
+
+
+@contextmanager
+def blend_backend(backend):
+    """Composite RGB images with backend inside the block, wherever the engine blends its overlay layers"""
+    if backend == "pillow":
+        yield
+        return
+
+    pillow_blend = engine.blend_placements
+
+    def numpy_blend(base, placements):
+        if base.mode == "RGB":
+            npblend.blend_placements(base, placements)
+        else:
+            pillow_blend(base, placements)
+
+    engine.blend_placements = numpy_blend
+    try:
+        yield
+    finally:
+        engine.blend_placements = pillow_blend
+
+
+def verify_blend(paths, job, overlays):
+    """Composite every corpus image with both blend backends; returns the names whose pixels differ"""
+    watermark, header, footer = overlays
+    mismatches = []
+    for corpus, path in paths.items():
+        decoded = engine.native_base(Image.open(path))
+        for scale in (1.0, 0.25):
+            base = decoded if scale == 1.0 else decoded.resize((round(decoded.width * scale),
+                                                                round(decoded.height * scale)))
+            rendered = []
+            for backend in BLEND_BACKENDS:
+                with blend_backend(backend):
+                    rendered.append(engine.apply_overlays(base.copy(), watermark, header, footer,
+                                                          engine.scaled_job(job, scale), engine.OverlayCache(), scale))
+            identical = rendered[0].tobytes() == rendered[1].tobytes()
+            print(f"{corpus:<14}{base.mode:<6}{base.width:>6}x{base.height:<6}"
+                  f"{'identical' if identical else 'DIFFERENT'}")
+            if not identical:
+                mismatches.append(corpus)
+    return mismatches
+
+
+def compare(results, baseline):
+    """Print images/sec of this run relative to a baseline JSON report"""
+    previous = {(r['corpus'], r['stage']): r for r in baseline['results']}
+    print(f"\n{'corpus':<14}{'stage':<11}{'before':>10}{'after':>10}{'change':>9}")
+    for result in results:
+        old = previous.get((result['corpus'], result['stage']))
+        if not old:
+            continue
+        change = result['images_per_sec'] / old['images_per_sec'] - 1
+        print(f"{result['corpus']:<14}{result['stage']:<11}{old['images_per_sec']:>10.2f}"
+              f"{result['images_per_sec']:>10.2f}{change:>+9.1%}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the watermarking hot paths.")
+    parser.add_argument("--corpus", help="folder for the synthesized images (default: a temporary folder)")
+    parser.add_argument("--scale", type=float, default=1.0,
+                        help="scale factor for corpus image sizes, e.g. 0.25 for a quick run (default: 1)")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per stage (default: 5)")
+    parser.add_argument("--only", action="append", choices=sorted(CORPUS), help="benchmark only this corpus image")
+    parser.add_argument("--encoder", choices=list(engine.ENCODER_PROFILES), default="default",
+                        help="encoder profile for the encode and total stages (default: default)")
+    parser.add_argument("--blend", choices=BLEND_BACKENDS, default="pillow",
+                        help="blend backend for the composite and total stages (default: pillow)")
+    parser.add_argument("--verify", action="store_true",
+                        help="first check that the numpy blend backend matches pillow bit for bit")
+    parser.add_argument("--json", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="earlier JSON results to compare images/sec against")
+    args = parser.parse_args(argv)
+
+    corpus_dir = args.corpus or os.path.join(tempfile.gettempdir(), f"watermark-bench-{args.scale:g}")
+    paths, assets = build_corpus(corpus_dir, args.scale)
+
+    job = WatermarkJob(watermark_path=assets['watermark'], header_path=assets['header'],
+                       footer_path=assets['footer'], add_text=True, custom_text="© Benchmark Studio 2024",
+                       font_size=60, text_shadow=True, text_outline=True, text_background=True, workers=1,
+                       encoder=args.encoder)
+    engine.check_encoder(job.encoder_profile())
+    if (args.verify or args.blend == "numpy") and not npblend.available():
+        parser.error("the numpy blend backend needs NumPy, which is not installed")
+    overlays = engine.prepare_overlays(job)
+
+    if args.verify:
+        selected = {corpus: path for corpus, path in paths.items() if not args.only or corpus in args.only}
+        if verify_blend(selected, job, overlays):
+            return 1
+        print()
+
+    results = []
+    print(f"{'corpus':<14}{'stage':<11}{'img/s':>9}{'MB/s':>9}{'p50 ms':>10}{'p99 ms':>10}{'peak MB':>9}")
+    for corpus, path in paths.items():
+        if args.only and corpus not in args.only:
+            continue
+        with blend_backend(args.blend):
+            corpus_results = benchmark_image(corpus, path, job, overlays, args.repeat)
+        for result in corpus_results:
+            results.append(result)
+            print(f"{corpus:<14}{result['stage']:<11}{result['images_per_sec']:>9.2f}{result['mb_per_sec']:>9.1f}"
+                  f"{result['p50_ms']:>10.1f}{result['p99_ms']:>10.1f}{result['peak_rss_mb']:>9.0f}")
+
+    report = {
+        'meta': {
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'scale': args.scale,
+            'repeat': args.repeat,
+            'encoder': args.encoder,
+            'blend': args.blend,
+            'timestamp': time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        'results': results,
+    }
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as output:
+            json.dump(report, output, indent=2)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as baseline:
+            compare(results, json.load(baseline))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
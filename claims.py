@@ -0,0 +1,179 @@
+"""Claiming inbox files so several nodes can share one input folder without double-processing.
+
+A node claims a file by renaming it from the inbox into its own folder under
+.processing/ in the inbox. A rename is atomic on local filesystems and on NFS,
+so when two nodes race for a file exactly one rename succeeds and the other
+finds it gone. The claim folder is on the same filesystem as the inbox, so
+claiming never copies data, and discovery skips it because it is hidden.
+
+Each node refreshes a heartbeat file next to its claim folder. A node whose
+heartbeat has not moved for timeout seconds is presumed dead, and any other
+node returns its claimed files to the inbox. Heartbeat ages are measured
+against the checking node's own heartbeat, so both timestamps come from the
+same file server clock and clock skew between machines does not matter. When a
+node stops, whatever it still holds (images that failed) is returned too.
+"""
+import os
+import socket
+import threading
+
+
+CLAIMS_DIR = ".processing"
+HEARTBEAT_SUFFIX = ".heartbeat"
+DEFAULT_TIMEOUT = 300.0
+
+
+def default_node_name():
+    """Unique per process: host name and process id"""
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def _files(root):
+    """Relative names of every file below root"""
+    pending = [""]
+    while pending:
+        folder = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, folder)) as listing:
+                entries = list(listing)
+        except OSError:
+            continue
+        for entry in entries:
+            name = os.path.join(folder, entry.name) if folder else entry.name
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(name)
+            else:
+                yield name
+
+
+def _prune(root):
+    """Remove root and the empty folders below it, bottom up; folders still holding files stay"""
+    for folder, _, _ in sorted(os.walk(root), key=lambda item: -len(item[0])):
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+
+
+class ClaimBox:
+    """This node's claims on an inbox folder.
+
+    start() before claiming and close() when done; in between a daemon thread
+    refreshes the heartbeat and returns stale nodes' claims to the inbox.
+    """
+
+    def __init__(self, inbox, node=None, timeout=DEFAULT_TIMEOUT):
+        self.inbox = inbox
+        self.node = node or default_node_name()
+        if self.node.startswith('.') or os.sep in self.node or (os.altsep and os.altsep in self.node):
+            raise ValueError(f"Invalid node name {self.node!r}")
+        self.timeout = timeout
+        self.root = os.path.join(inbox, CLAIMS_DIR)
+        # Claimed files live here under their inbox-relative names; the pipeline reads from it
+        self.directory = os.path.join(self.root, self.node)
+        self.heartbeat = self.directory + HEARTBEAT_SUFFIX
+        self.recovered = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Announce this node, take back its own leftovers from a previous run and recover stale nodes"""
+        # The heartbeat exists before the claim folder, so a folder without one is always stale
+        self.beat()
+        os.makedirs(self.directory, exist_ok=True)
+        self.release_all()
+        self.recover_stale()
+        self._thread = threading.Thread(target=self._beat_loop, daemon=True)
+        self._thread.start()
+        return self
+
+    def claim(self, name):
+        """Move inbox file name into this node's claim folder; False when another node got it first"""
+        claimed = os.path.join(self.directory, name)
+        # Also recreates the claim folder if a peer wrongly recovered this node and pruned it
+        os.makedirs(os.path.dirname(claimed), exist_ok=True)
+        try:
+            os.rename(os.path.join(self.inbox, name), claimed)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def release(self, name):
+        """Return a claimed file to the inbox"""
+        self._return(self.directory, name)
+
+    def release_all(self):
+        """Return every file this node still holds to the inbox"""
+        for name in list(_files(self.directory)):
+            self.release(name)
+
+    def beat(self):
+        """Refresh this node's heartbeat, recreating it if a peer wrongly recovered this node"""
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            os.utime(self.heartbeat)
+        except FileNotFoundError:
+            open(self.heartbeat, 'ab').close()
+
+    def recover_stale(self):
+        """Return the claims of every node whose heartbeat is older than timeout to the inbox"""
+        try:
+            now = os.stat(self.heartbeat).st_mtime
+            with os.scandir(self.root) as listing:
+                entries = list(listing)
+        except OSError:
+            return
+        for entry in entries:
+            if not entry.is_dir(follow_symlinks=False) or entry.name == self.node:
+                continue
+            try:
+                last_beat = os.stat(entry.path + HEARTBEAT_SUFFIX).st_mtime
+            except FileNotFoundError:
+                last_beat = None
+            if last_beat is not None and now - last_beat < self.timeout:
+                continue
+
+            for name in list(_files(entry.path)):
+                if self._return(entry.path, name):
+                    self.recovered += 1
+            _prune(entry.path)
+            if not os.path.exists(entry.path):
+                try:
+                    os.remove(entry.path + HEARTBEAT_SUFFIX)
+                except OSError:
+                    pass
+
+    def close(self):
+        """Stop the heartbeat, return anything still held and withdraw this node"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.release_all()
+        _prune(self.directory)
+        try:
+            os.remove(self.heartbeat)
+        except OSError:
+            pass
+
+    def _return(self, folder, name):
+        """Rename folder/name back to the inbox; False if it is gone (another node recovered it)"""
+        destination = os.path.join(self.inbox, name)
+        if os.path.dirname(name):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if os.path.exists(destination):
+            # A newer delivery under the same name is already waiting; keep the claimed copy aside
+            return False
+        try:
+            os.rename(os.path.join(folder, name), destination)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def _beat_loop(self):
+        interval = max(1.0, self.timeout / 4)
+        while not self._stop.wait(interval):
+            try:
+                self.beat()
+                self.recover_stale()
+            except OSError:
+                pass
@@ -0,0 +1,218 @@
+"""Command line entry point for running batches without the GUI."""
+import argparse
+import sys
+import threading
+
+from engine import (WatermarkJob, OutputProfile, ENCODER_PROFILES, watermark_batch,
+                    watch_inbox, check_encoder, DEFAULT_STATE_DIR)
+from outputcache import DEFAULT_MAX_BYTES
+from metrics import write_json, write_prometheus
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="bulk-watermark",
+                                     description="Apply header, footer, watermark and text overlays to a folder of images.")
+    parser.add_argument("--input", default="RAW", help="folder with images to process (default: RAW)")
+    parser.add_argument("--output", default="Done", help="folder for processed images (default: Done)")
+    parser.add_argument("--archive", default="Archive", help="folder originals are moved to (default: Archive)")
+    parser.add_argument("--config", help="JSON file with WatermarkJob settings")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: CPU count)")
+    parser.add_argument("--recursive", action="store_true",
+                        help="also process images in subfolders of the input folder, mirroring them in the outputs")
+    parser.add_argument("--shard", metavar="INDEX/COUNT",
+                        help="process only this share of the input folder, e.g. 0/4 on the first of four "
+                             "machines; files are split by a hash of their name, no coordination needed")
+    parser.add_argument("--distributed", action="store_true",
+                        help="claim each image before processing it, so several machines or processes can share "
+                             "one input folder (e.g. on NFS) without processing a file twice")
+    parser.add_argument("--node", help="name of this node's claim folder with --distributed; a stable name lets a "
+                                       "restarted node resume its own claims (default: host name and process id)")
+    parser.add_argument("--claim-timeout", type=float,
+                        help="seconds without a heartbeat after which a node's claimed images are returned to the "
+                             "input folder with --distributed (default: 300)")
+    parser.add_argument("--archive-threads", type=int,
+                        help="threads moving originals to the archive folder (default: 2); raise for network storage")
+    parser.add_argument("--memory-mb", type=int,
+                        help="estimated image memory the workers may hold at once; larger images wait, and one "
+                             "bigger than the whole budget runs alone (default: half the physical memory)")
+    parser.add_argument("--profile", action="append", type=OutputProfile.parse, metavar="NAME[:SIZE]",
+                        help="output profile, repeatable: NAME (full size), NAME:MAX_EDGE (e.g. web:2048) "
+                             "or NAME:SCALE (e.g. half:0.5); each is written to its own subfolder")
+    parser.add_argument("--encoder", choices=list(ENCODER_PROFILES),
+                        help="encoder profile: default (JPEG q95 / optimized PNG), fast, web (progressive JPEG), "
+                             "webp, avif or lossless (PNG); overrides the config file")
+    parser.add_argument("--report", metavar="PATH",
+                        help="write a JSON run report: counts, per-stage timing histograms, pipeline and encoding")
+    parser.add_argument("--prometheus", metavar="PATH",
+                        help="write the stage timing histograms and counts as a Prometheus text file "
+                             "(e.g. for node_exporter's textfile collector)")
+    parser.add_argument("--profiling", type=int, metavar="N",
+                        help="profile the first N images rendered (cProfile and tracemalloc, also inside the worker "
+                             "processes) and write pstats files and allocation top lists")
+    parser.add_argument("--profiling-dir",
+                        help="folder for the profiles; each run gets a timestamped subfolder "
+                             "(default: profiles in the state folder)")
+    parser.add_argument("--state-dir", default=DEFAULT_STATE_DIR,
+                        help=f"folder for the job manifest and output cache (default: {DEFAULT_STATE_DIR})")
+    parser.add_argument("--no-state", action="store_true",
+                        help="keep neither the job manifest nor the output cache")
+    parser.add_argument("--output-cache-mb", type=int, default=DEFAULT_MAX_BYTES // 1024 ** 2,
+                        help="size of the content-addressed output cache in the state folder, 0 disables it "
+                             f"(default: {DEFAULT_MAX_BYTES // 1024 ** 2})")
+    parser.add_argument("--watch", action="store_true",
+                        help="keep running and process images as they finish arriving in the input folder")
+    parser.add_argument("--settle", type=float, default=2.0,
+                        help="seconds a file must stay unchanged before --watch processes it (default: 2)")
+    return parser
+
+
+def print_pipeline_report(report):
+    """Per-stage utilization and the depth of the queue feeding each stage"""
+    if not report:
+        return
+    print(f"Pipeline ({report['wall_seconds']:.1f}s):")
+    for stage, stats in report['stages'].items():
+        feed = report['queues'][stage]
+        print(f"  {stage:<10} {stats['items']:>6} items  {stats['utilization']:>6.1%} busy  "
+              f"queue peak {feed['peak']}/{feed['capacity']}, mean {feed['mean']}")
+    memory = report.get('memory')
+    if memory and memory['budget']:
+        print(f"  memory     peak {memory['peak_reserved'] / 1024 ** 2:.0f} MB of {memory['budget'] / 1024 ** 2:.0f} MB "
+              f"budget, {memory['deferred']} images waited for memory")
+    archived = report.get('archived')
+    if archived and archived['copied']:
+        print(f"  archive    {archived['renamed']} renamed, {archived['copied']} copied across filesystems")
+
+
+def print_stage_report(stage_times):
+    """Per-image time in each stage: mean, percentiles and share of all stage time"""
+    stages = stage_times.ordered()
+    if not stages:
+        return
+    total = sum(histogram.sum for _, histogram in stages) or 1.0
+    print("Stages (ms per image):   mean      p50      p90      p99      max   share")
+    for stage, histogram in stages:
+        report = histogram.report()
+        print(f"  {stage:<14} {report['mean_ms']:>9.1f} {report['p50_ms']:>8.1f} {report['p90_ms']:>8.1f} "
+              f"{report['p99_ms']:>8.1f} {report['max_ms']:>8.1f} {histogram.sum / total:>7.1%}")
+
+
+def print_encoding_report(encoder, encoding):
+    """Time and bytes spent encoding each output profile"""
+    if not encoding:
+        return
+    print(f"Encoding ({encoder}):")
+    for name, stats in encoding.items():
+        per_image = stats['seconds'] / stats['images'] * 1000
+        print(f"  {name:<10} {stats['images']:>6} images  {stats['seconds']:>8.2f}s  {per_image:>7.1f} ms/image  "
+              f"{stats['bytes'] / 1024 ** 2:>9.1f} MB")
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    try:
+        job = WatermarkJob.from_config(args.config) if args.config else WatermarkJob()
+    except (OSError, ValueError, TypeError) as e:
+        print(f"Cannot load config {args.config}: {e}", file=sys.stderr)
+        return 2
+
+    if args.workers is not None:
+        job.workers = max(1, args.workers)
+    if args.recursive:
+        job.recursive = True
+    if args.shard:
+        job.shard = args.shard
+    if args.distributed:
+        job.distributed = True
+    if args.node:
+        job.node_name = args.node
+    if args.claim_timeout is not None:
+        job.claim_timeout = max(1.0, args.claim_timeout)
+    if args.profiling is not None:
+        job.profiling = max(0, args.profiling)
+    if args.profiling_dir:
+        job.profiling_dir = args.profiling_dir
+    if args.archive_threads is not None:
+        job.archive_threads = max(1, args.archive_threads)
+    if args.memory_mb is not None:
+        job.memory_budget_mb = max(0, args.memory_mb)
+    if args.profile:
+        job.profiles = args.profile
+    if args.encoder:
+        job.encoder = args.encoder
+    try:
+        check_encoder(job.encoder_profile())
+        job.input_shard()
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 2
+    state_dir = None if args.no_state else args.state_dir
+    output_cache_bytes = max(0, args.output_cache_mb) * 1024 ** 2
+
+    def on_result(result, completed, total):
+        if result.error is not None:
+            print(f"[{completed}/{total}] Failed to process {result.image_file}: {result.error}")
+        elif result.skipped:
+            print(f"[{completed}/{total}] Unchanged, archived: {result.image_file}")
+        elif result.reused:
+            print(f"[{completed}/{total}] Copied from output cache: {result.image_file}")
+        else:
+            print(f"[{completed}/{total}] Processed: {result.image_file}")
+
+    if args.watch:
+        stop_event = threading.Event()
+        summaries = []
+
+        finished = threading.Event()
+
+        def run_watch():
+            try:
+                summaries.append(watch_inbox(args.input, args.output, args.archive, job, stop_event,
+                                             on_result=on_result, log=print, settle_seconds=args.settle,
+                                             state_dir=state_dir, output_cache_bytes=output_cache_bytes))
+            finally:
+                finished.set()
+
+        print(f"Watching {args.input} (Ctrl+C to stop)")
+        threading.Thread(target=run_watch).start()
+        # Wait on an Event rather than Thread.join: a join interrupted by Ctrl+C can leave the thread
+        # marked as stopped, so the next join returns at once and the run is cut short
+        try:
+            while not finished.wait(0.5):
+                pass
+        except KeyboardInterrupt:
+            print("Stopping, waiting for images in flight...")
+            stop_event.set()
+            finished.wait()
+        if not summaries:
+            return 1
+        summary = summaries[0]
+    else:
+        summary = watermark_batch(args.input, args.output, args.archive, job,
+                                  on_result=on_result, log=print, state_dir=state_dir,
+                                  output_cache_bytes=output_cache_bytes)
+
+    if summary.total == 0:
+        print(f"No supported images found in {args.input}")
+    else:
+        print(f"Processed {summary.processed}/{summary.total} images "
+              f"({summary.skipped} unchanged, {summary.reused} from output cache, {summary.failed} failed)")
+        print(f"Overlay cache: {summary.cache_hits} hits / {summary.cache_misses} misses")
+        print_pipeline_report(summary.pipeline)
+        print_stage_report(summary.stage_times)
+        print_encoding_report(job.encoder, summary.encoding)
+
+    try:
+        if args.report:
+            write_json(args.report, summary.report(job))
+        if args.prometheus:
+            write_prometheus(args.prometheus, summary.stage_times, summary.counts())
+    except OSError as e:
+        print(f"Cannot write run metrics: {e}", file=sys.stderr)
+        return 1
+    return 1 if summary.failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+"""Streaming discovery of the images waiting in an inbox.
+
+Folders are walked with os.scandir, so file types come from the directory
+listing rather than a stat per entry, and names are yielded as they are found
+instead of being collected first. A file is taken when its first bytes carry
+the signature of a supported format, whatever its extension says. Hidden
+entries (temporary uploads, state folders) are skipped and symlinked folders
+are not followed.
+
+Sharding splits one inbox between processes or machines without coordination:
+each keeps the names whose stable hash modulo the shard count equals its index.
+"""
+import os
+import zlib
+
+
+# Leading bytes of each supported format; WebP also needs "WEBP" at offset 8
+SIGNATURES = (
+    (b"\xff\xd8\xff", "JPEG"),
+    (b"\x89PNG\r\n\x1a\n", "PNG"),
+    (b"GIF87a", "GIF"),
+    (b"GIF89a", "GIF"),
+    (b"II*\0", "TIFF"),
+    (b"MM\0*", "TIFF"),
+    (b"BM", "BMP"),
+)
+
+_SNIFF_BYTES = 12
+
+
+def parse_shard(spec):
+    """Parse "INDEX/COUNT" (e.g. "0/4") into (index, count)"""
+    index, sep, count = spec.partition('/')
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ValueError(f"Invalid shard {spec!r}; expected INDEX/COUNT, e.g. 0/4") from None
+    if not sep or count < 1 or not 0 <= index < count:
+        raise ValueError(f"Invalid shard {spec!r}; INDEX must be between 0 and COUNT - 1")
+    return index, count
+
+
+def in_shard(name, shard):
+    """True when name belongs to shard (index, count); None takes every name.
+
+    The hash is of the name relative to the inbox with "/" separators, so every
+    node agrees on the split whatever its platform or mount point.
+    """
+    if shard is None or shard[1] <= 1:
+        return True
+    index, count = shard
+    return zlib.crc32(name.replace(os.sep, '/').encode('utf-8', 'surrogateescape')) % count == index
+
+
+def sniff_format(path):
+    """Image format named by path's leading bytes, or None when it is not a supported image"""
+    try:
+        with open(path, 'rb') as source:
+            head = source.read(_SNIFF_BYTES)
+    except OSError:
+        return None
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP"
+    for signature, image_format in SIGNATURES:
+        if head.startswith(signature):
+            return image_format
+    return None
+
+
+def iter_images(root, recursive=False, shard=None, exclude=()):
+    """Yield the names, relative to root, of the supported images in root.
+
+    With recursive, subfolders are walked too and names include their folder
+    (e.g. "2024/shoot/a.jpg"). Folders in exclude, such as an output or archive
+    folder nested inside root, are never entered.
+    """
+    excluded = {os.path.realpath(path) for path in exclude}
+    pending = [""]
+    while pending:
+        folder = pending.pop()
+        try:
+            entries = os.scandir(os.path.join(root, folder))
+        except OSError:
+            continue
+        subfolders = []
+        with entries:
+            for entry in entries:
+                if entry.name.startswith('.'):
+                    continue
+                name = os.path.join(folder, entry.name) if folder else entry.name
+                try:
+                    if entry.is_file():
+                        if in_shard(name, shard) and sniff_format(entry.path):
+                            yield name
+                    elif recursive and entry.is_dir(follow_symlinks=False):
+                        if os.path.realpath(entry.path) not in excluded:
+                            subfolders.append(name)
+                except OSError:
+                    continue
+        # Depth-first in listing order: push in reverse so the first subfolder is walked next
+        pending.extend(reversed(subfolders))
@@ -0,0 +1,1140 @@
+"""Headless watermarking engine shared by the GUI and the bulk-watermark command.
+
+Nothing in this module touches Tkinter, so it can be imported and run on
+display-less servers (cron jobs, containers) without any window setup cost.
+"""
+from PIL import Image, ImageDraw, ImageFont, ImageSequence, UnidentifiedImageError, features
+import io
+import os
+import json
+import time
+import queue
+import signal
+import threading
+from pathlib import Path
+import multiprocessing
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field, asdict, fields, replace
+from concurrent.futures import ProcessPoolExecutor
+
+from overlays import OverlayCache, asset_fingerprint, opacity_table
+from watcher import InboxWatcher
+from discovery import iter_images, parse_shard
+from claims import ClaimBox, DEFAULT_TIMEOUT
+from metrics import RunMetrics, StageTimer
+from profiling import ImageProfiler, run_folder, combine
+from manifest import JobManifest, settings_hash
+from outputcache import OutputCache, DEFAULT_MAX_BYTES
+from pipeline import Pipeline
+from atomicfs import temp_path
+from tiles import TiffBands, BandReducer, StripTiffWriter, band_layout, band_rows, reduction_factor
+
+
+
+# Where run state such as the job manifest is kept, relative to the working directory
+DEFAULT_STATE_DIR = ".watermark"
+
+# Extension of an output whose format differs from its source's
+FORMAT_EXTENSIONS = {"JPEG": ".jpg", "PNG": ".png", "WEBP": ".webp", "AVIF": ".avif", "GIF": ".gif", "TIFF": ".tif"}
+
+# Source formats whose extra frames (animation frames, document pages) are kept; MPO's second JPEG is not
+MULTI_FRAME_FORMATS = {"GIF", "WEBP", "PNG", "TIFF"}
+
+# Distance of the text block from the image edges at full size; renditions scale it with everything else
+TEXT_MARGIN = 50
+
+
+@dataclass
+class OutputProfile:
+    """A named output size: longest edge capped at max_edge, or scaled by scale, or full size"""
+    name: str
+    max_edge: int = None
+    scale: float = None
+
+    @classmethod
+    def parse(cls, spec):
+        """Parse NAME, NAME:MAX_EDGE (e.g. web:2048) or NAME:SCALE (e.g. half:0.5)"""
+        name, _, size = spec.partition(':')
+        if not size:
+            return cls(name)
+        if '.' in size:
+            return cls(name, scale=float(size))
+        return cls(name, max_edge=int(size))
+
+    def target_size(self, width, height):
+        """Output size for a width x height source; never upscales"""
+        factor = 1.0
+        if self.scale:
+            factor = min(1.0, self.scale)
+        elif self.max_edge:
+            factor = min(1.0, self.max_edge / max(width, height))
+        return max(1, round(width * factor)), max(1, round(height * factor))
+
+
+@dataclass
+class EncoderProfile:
+    """Named output encoding: an optional format every output is converted to, and Pillow save options per format"""
+    name: str
+    format: str = None
+    options: dict = field(default_factory=dict)
+
+
+# Without a forced format, JPEG sources stay JPEG and everything else is written as PNG;
+# multi-frame GIF, WebP and TIFF sources keep their own format, and the full-size renditions of
+# tiled renders are TIFF
+ENCODER_PROFILES = {
+    # Smallest files of the keep-the-format profiles; PNG optimize can outlast all of the compositing
+    'default': EncoderProfile('default', options={'JPEG': {'quality': 95, 'optimize': True},
+                                                  'PNG': {'optimize': True},
+                                                  'TIFF': {'compression': 'tiff_deflate'}}),
+    # Throughput first: no Huffman optimization pass, fastest zlib level
+    'fast': EncoderProfile('fast', options={'JPEG': {'quality': 90, 'subsampling': '4:2:0'},
+                                            'PNG': {'compress_level': 1},
+                                            'TIFF': {'compression': 'tiff_deflate'}}),
+    # Progressive JPEGs for the web; PNG at zlib's default level
+    'web': EncoderProfile('web', options={'JPEG': {'quality': 85, 'subsampling': '4:2:0', 'progressive': True,
+                                                   'optimize': True},
+                                          'PNG': {'compress_level': 6},
+                                          'TIFF': {'compression': 'tiff_deflate'}}),
+    'webp': EncoderProfile('webp', 'WEBP', {'WEBP': {'quality': 85, 'method': 4}}),
+    'avif': EncoderProfile('avif', 'AVIF', {'AVIF': {'quality': 65, 'speed': 6}}),
+    'lossless': EncoderProfile('lossless', 'PNG', {'PNG': {'compress_level': 6}}),
+}
+
+
+@dataclass
+class WatermarkJob:
+    """Every setting that controls how a batch is rendered"""
+    watermark_path: str = "assets/watermark.png"
+    header_path: str = "assets/header.png"
+    footer_path: str = "assets/footer.png"
+    opacity: float = 80.0
+    footer_margin: int = 20
+    footer_bottom_margin: int = 10
+    header_top_margin: int = 10
+    add_text: bool = False
+    custom_text: str = ""
+    font_size: int = 30
+    text_bold: bool = False
+    text_italic: bool = False
+    text_shadow: bool = True
+    text_background: bool = False
+    text_position: str = "bottom-left"
+    text_outline: bool = False
+    text_color: str = "#FFFFFF"
+    text_bg_color: str = "#000000"
+    text_outline_color: str = "#000000"
+    workers: int = field(default_factory=lambda: os.cpu_count() or 1)
+    # Empty means one full-size output straight into the output folder
+    profiles: list = field(default_factory=list)
+    # Name in ENCODER_PROFILES, and per-format save options merged over it, e.g. {"JPEG": {"quality": 85}}
+    encoder: str = "default"
+    encoder_options: dict = field(default_factory=dict)
+    # Estimated bytes of images the workers may hold at once; 0 means half the physical memory
+    memory_budget_mb: int = 0
+    # Threads moving originals into the archive folder
+    archive_threads: int = 2
+    # Also take images from subfolders of the input folder, mirroring them in the output and archive
+    recursive: bool = False
+    # "INDEX/COUNT" to take only this node's share of the input folder, e.g. "0/4"; empty takes everything
+    shard: str = ""
+    # Claim each input before processing it, so several nodes can share one input folder
+    distributed: bool = False
+    # This node's claim folder name; empty means host name and process id
+    node_name: str = ""
+    # Seconds without a heartbeat after which a node's claims are returned to the input folder
+    claim_timeout: float = DEFAULT_TIMEOUT
+    # Profile the first N images rendered with cProfile and tracemalloc; 0 disables profiling
+    profiling: int = 0
+    # Each run's profiles go to a new timestamped folder in here; empty means "profiles" in the state folder
+    profiling_dir: str = ""
+
+    def __post_init__(self):
+        self.profiles = [p if isinstance(p, OutputProfile) else OutputProfile(**p) for p in self.profiles]
+        if self.encoder not in ENCODER_PROFILES:
+            raise ValueError(f"Unknown encoder profile {self.encoder!r}; choose from {', '.join(ENCODER_PROFILES)}")
+        self.input_shard()
+
+    @classmethod
+    def from_config(cls, path):
+        """Load a job from a JSON file whose keys match the field names"""
+        with open(path, encoding='utf-8') as config_file:
+            data = json.load(config_file)
+
+        known = {f.name for f in fields(cls)}
+        unknown = set(data) - known
+        if unknown:
+            raise ValueError(f"Unknown settings in {path}: {', '.join(sorted(unknown))}")
+        return cls(**data)
+
+    def to_dict(self):
+        return asdict(self)
+
+    def input_shard(self):
+        """(index, count) parsed from shard, or None to take every input"""
+        return parse_shard(self.shard) if self.shard else None
+
+    def encoder_profile(self):
+        """The selected EncoderProfile with encoder_options applied"""
+        profile = ENCODER_PROFILES[self.encoder]
+        if not self.encoder_options:
+            return profile
+        options = {image_format: dict(save_options) for image_format, save_options in profile.options.items()}
+        for image_format, overrides in self.encoder_options.items():
+            options.setdefault(image_format.upper(), {}).update(overrides)
+        return replace(profile, options=options)
+
+
+@dataclass
+class BatchSummary:
+    """Outcome of a watermark_batch run"""
+    total: int = 0
+    processed: int = 0
+    failed: int = 0
+    skipped: int = 0
+    reused: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # Queue depths and per-stage utilization from Pipeline.report()
+    pipeline: dict = field(default_factory=dict)
+    # Per output profile: images encoded, seconds spent encoding and bytes produced
+    encoding: dict = field(default_factory=dict)
+    # Histogram of per-image seconds for every stage (see metrics.STAGES)
+    stage_times: RunMetrics = field(default_factory=RunMetrics, repr=False)
+    worker_caches: dict = field(default_factory=dict, repr=False)
+
+    def record(self, result):
+        """Count one finished TaskResult"""
+        if result.error is None:
+            self.processed += 1
+            if result.skipped:
+                self.skipped += 1
+            if result.reused:
+                self.reused += 1
+        else:
+            self.failed += 1
+
+        for name, seconds in result.encode_seconds.items():
+            stats = self.encoding.setdefault(name, {'images': 0, 'seconds': 0.0, 'bytes': 0})
+            stats['images'] += 1
+            stats['seconds'] += seconds
+            stats['bytes'] += result.output_bytes.get(name, 0)
+        self.stage_times.observe(result.timings)
+
+        # Worker counters are cumulative, so keep only the latest report per worker
+        self.worker_caches[result.worker] = (result.cache_hits, result.cache_misses)
+        self.cache_hits = sum(hits for hits, _ in self.worker_caches.values())
+        self.cache_misses = sum(misses for _, misses in self.worker_caches.values())
+
+    def counts(self):
+        """Image counts of the run, by outcome"""
+        return {'total': self.total, 'processed': self.processed, 'failed': self.failed,
+                'unchanged': self.skipped, 'reused': self.reused}
+
+    def report(self, job=None):
+        """Everything measured in the run, as a JSON-ready dict"""
+        report = {'counts': self.counts(),
+                  'overlay_cache': {'hits': self.cache_hits, 'misses': self.cache_misses},
+                  'stages': self.stage_times.report(),
+                  'pipeline': self.pipeline,
+                  'encoding': self.encoding}
+        if job is not None:
+            report['settings'] = job.to_dict()
+        return report
+
+
+@dataclass
+class TaskResult:
+    """What a pool worker reports back for one image"""
+    image_file: str
+    error: str = None
+    skipped: bool = False
+    reused: bool = False
+    worker: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+    # Per output profile, only for images that were encoded in this run
+    encode_seconds: dict = field(default_factory=dict)
+    output_bytes: dict = field(default_factory=dict)
+    # Seconds spent per stage (see metrics.STAGES)
+    timings: dict = field(default_factory=dict)
+
+
+@dataclass
+class RenderResult:
+    """Encoded outputs a pool worker sends back to the pipeline's writers"""
+    outputs: dict = field(default_factory=dict)
+    error: str = None
+    render_seconds: float = 0.0
+    encode_seconds: dict = field(default_factory=dict)
+    # Seconds per worker-side stage: decode, resize, overlay_prep, text, composite, encode
+    timings: dict = field(default_factory=dict)
+    worker: int = 0
+    cache_hits: int = 0
+    cache_misses: int = 0
+
+
+@dataclass
+class SourcePlan:
+    """How one input is rendered, decided from its header before any pixels are decoded"""
+    output_format: str
+    # Animation frames or document pages, all composited and written to one output
+    frames: int = 1
+    # Streamed from disk band by band instead of decoded whole (TIFFs over the memory budget)
+    tiled: bool = False
+    # Estimated peak bytes of rendering it, for memory admission
+    memory: int = 0
+    # {profile name: format} for renditions written in another format than output_format: the
+    # full-size renditions of a tiled plan, which can only be streamed as TIFF
+    profile_formats: dict = field(default_factory=dict)
+
+    def cache_format(self):
+        """Every output format of the plan, as one output cache key component"""
+        return ";".join([self.output_format] + [f"{name}={image_format}"
+                                                for name, image_format in sorted(self.profile_formats.items())])
+
+
+# Overlays and settings prepared once per pool worker by _init_worker
+_worker_state = {}
+
+
+def _init_worker(watermark, header, footer, job, profiler=None):
+    """Receive the prepared overlays, and the run's ImageProfiler if any, once when a pool worker starts"""
+    # Ctrl+C is handled by the parent, which lets in-flight images finish
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_state.update(watermark=watermark, header=header, footer=footer, job=job,
+                         encoder=job.encoder_profile(), overlay_cache=OverlayCache(), profiler=profiler)
+
+
+def _render_task(image_file, source, plan, destinations):
+    """Decode, composite and encode one image inside a pool worker.
+
+    source is the prefetched file content, or the file's path for a tiled plan,
+    which streams from disk and leaves its full-size outputs in temporary files
+    next to destinations. While the run's profiler has slots left, the whole
+    render (decode, overlays, text and encode) is profiled.
+    """
+    overlay_cache = _worker_state['overlay_cache']
+    encoder = _worker_state['encoder']
+    overlays = (_worker_state['watermark'], _worker_state['header'], _worker_state['footer'], _worker_state['job'])
+    rendered = RenderResult(worker=os.getpid())
+    timer = StageTimer()
+    started = time.perf_counter()
+    profiling = _worker_state['profiler'].profiled(image_file) if _worker_state['profiler'] else nullcontext()
+    with profiling:
+        try:
+            if plan.tiled:
+                rendered.outputs, rendered.encode_seconds = render_tiled(source, destinations, *overlays,
+                                                                         overlay_cache, encoder, timer,
+                                                                         plan.output_format)
+            elif plan.frames > 1:
+                for profile, frames, timing in render_frames(io.BytesIO(source), *overlays, overlay_cache, timer):
+                    encode_started = time.perf_counter()
+                    rendered.outputs[profile.name] = encode_frames(frames, plan.output_format, encoder, **timing)
+                    rendered.encode_seconds[profile.name] = time.perf_counter() - encode_started
+            else:
+                for profile, processed_image in render_profiles(io.BytesIO(source), *overlays, overlay_cache, timer):
+                    encode_started = time.perf_counter()
+                    rendered.outputs[profile.name] = encode_output(processed_image, image_file, encoder,
+                                                                   plan.output_format)
+                    rendered.encode_seconds[profile.name] = time.perf_counter() - encode_started
+        except UnidentifiedImageError:
+            # Pillow would name the in-memory buffer rather than the file
+            rendered.error = f"cannot identify image file {image_file!r}"
+        except Exception as e:
+            rendered.error = str(e)
+
+    rendered.render_seconds = time.perf_counter() - started
+    timer.add('encode', sum(rendered.encode_seconds.values()))
+    rendered.timings = timer.seconds
+    # Cumulative counters for this worker; the parent keeps the latest per worker
+    rendered.cache_hits = overlay_cache.hits
+    rendered.cache_misses = overlay_cache.misses
+    return rendered
+
+
+def load_asset(path, log=None):
+    """Load an asset image if it exists"""
+    if path and os.path.exists(path):
+        try:
+            return Image.open(path).convert("RGBA")
+        except Exception as e:
+            if log:
+                log(f"⚠️ Failed to load asset {Path(path).name}: {str(e)}")
+    return None
+
+
+def apply_opacity(image, opacity):
+    """Apply opacity to an RGBA (or premultiplied RGBa) image in a single lookup-table pass"""
+    if image and 0 <= opacity <= 1:
+        return image.point(opacity_table(opacity, image.mode == "RGBa"))
+    return image
+
+
+def watermark_opacity(job):
+    """The job's watermark opacity as a 0-1 factor; out-of-range values leave the asset as is"""
+    return job.opacity / 100.0 if 0 <= job.opacity <= 100 else 1.0
+
+
+def profile_dir(done_dir, profile, job):
+    """Folder a profile's renditions are written to"""
+    return os.path.join(done_dir, profile.name) if job.profiles else done_dir
+
+
+def output_format(image_file, encoder=None):
+    """The encoder's forced format, else JPEG for JPEG sources and PNG for everything else"""
+    if encoder and encoder.format:
+        return encoder.format
+    return "JPEG" if Path(image_file).suffix.lower() in ['.jpg', '.jpeg'] else "PNG"
+
+
+def output_path(image_file, out_dir, encoder=None, image_format=None):
+    """Where the processed version of image_file is written in out_dir; the name is kept when the format is"""
+    image_format = image_format or output_format(image_file, encoder)
+    if Image.registered_extensions().get(Path(image_file).suffix.lower()) == image_format:
+        return os.path.join(out_dir, image_file)
+    return os.path.join(out_dir, str(Path(image_file).with_suffix(FORMAT_EXTENSIONS[image_format])))
+
+
+def output_destinations(image_file, done_dir, job, image_format=None, profile_formats=None):
+    """Output path for each profile, keyed by profile name; subfolders of a nested image_file are created.
+
+    profile_formats ({profile name: format}) overrides image_format for some profiles.
+    """
+    encoder = job.encoder_profile()
+    profile_formats = profile_formats or {}
+    destinations = {profile.name: output_path(image_file, profile_dir(done_dir, profile, job), encoder,
+                                              profile_formats.get(profile.name, image_format))
+                    for profile in job.profiles or [OutputProfile("full")]}
+    if os.path.dirname(image_file):
+        for destination in destinations.values():
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+    return destinations
+
+
+def plan_source(image_path, job, budget=None):
+    """Read image_path's header and decide its output format, frame handling and memory estimate.
+
+    A single-frame TIFF whose whole-frame estimate exceeds budget is rendered
+    tiled when its layout can be streamed; anything else is decoded whole.
+    """
+    encoder = job.encoder_profile()
+    image_file = Path(image_path).name
+    size = os.path.getsize(image_path)
+    try:
+        header = Image.open(image_path)
+    except Exception:
+        # The worker will report the decode error without allocating a frame
+        return SourcePlan(output_format(image_file, encoder), memory=size)
+
+    with header:
+        frames = getattr(header, 'n_frames', 1) if header.format in MULTI_FRAME_FORMATS else 1
+        memory = estimate_render_bytes(header, size, job, frames)
+        if frames == 1 and budget is not None and memory > budget and band_layout(header):
+            # Only the full-size renditions are streamed; reduced ones keep the usual format
+            streamed = {profile.name: "TIFF" for profile in job.profiles or [OutputProfile("full")]
+                        if profile.target_size(*header.size) == header.size}
+            return SourcePlan(output_format(image_file, encoder), tiled=True,
+                              memory=estimate_tiled_bytes(header, job), profile_formats=streamed)
+
+        image_format = output_format(image_file, encoder)
+        if frames > 1 and not encoder.format:
+            image_format = header.format
+        return SourcePlan(image_format, frames, memory=memory)
+
+
+def check_encoder(encoder):
+    """Raise ValueError when this Pillow build cannot write the encoder's forced format"""
+    module = {"WEBP": "webp", "AVIF": "avif"}.get(encoder.format)
+    if module and not features.check(module):
+        raise ValueError(f"Pillow was built without {encoder.format} support, "
+                         f"so encoder profile {encoder.name!r} cannot be used")
+
+
+def encode_output(image, image_file, encoder=None, image_format=None):
+    """Encode a processed image with the encoder profile's save options for its output format"""
+    encoder = encoder or ENCODER_PROFILES['default']
+    image_format = image_format or output_format(image_file, encoder)
+    if image_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, image_format, **encoder.options.get(image_format, {}))
+    return buffer.getvalue()
+
+
+def encode_frames(frames, image_format, encoder=None, duration=None, loop=None):
+    """Encode composited frames as one animation (GIF, WebP, APNG, AVIF) or multi-page TIFF"""
+    encoder = encoder or ENCODER_PROFILES['default']
+    options = dict(encoder.options.get(image_format, {}))
+    if image_format != "TIFF":
+        if duration:
+            options['duration'] = duration
+        if loop is not None:
+            options['loop'] = loop
+
+    buffer = io.BytesIO()
+    frames[0].save(buffer, image_format, save_all=True, append_images=frames[1:], **options)
+    return buffer.getvalue()
+
+
+def get_text_position(image_width, image_height, text_bbox, position, margin=TEXT_MARGIN):
+    """Calculate text position based on selection, margin pixels from the chosen edges"""
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+
+    positions = {
+        "top-left": (margin, margin),
+        "top-center": ((image_width - text_width) // 2, margin),
+        "top-right": (image_width - text_width - margin, margin),
+        "center-left": (margin, (image_height - text_height) // 2),
+        "center": ((image_width - text_width) // 2, (image_height - text_height) // 2),
+        "center-right": (image_width - text_width - margin, (image_height - text_height) // 2),
+        "bottom-left": (margin, image_height - text_height - margin),
+        "bottom-center": ((image_width - text_width) // 2, image_height - text_height - margin),
+        "bottom-right": (image_width - text_width - margin, image_height - text_height - margin)
+    }
+
+    return positions.get(position, positions["bottom-left"])
+
+
+def process_single_image(image_path, watermark, header, footer, job, overlay_cache=None):
+    """Process a single image with all overlays and advanced text styling"""
+    raw_image = native_base(Image.open(image_path))
+    return apply_overlays(raw_image, watermark, header, footer, job, overlay_cache)
+
+
+def render_profiles(image_path, watermark, header, footer, job, overlay_cache=None, timer=None):
+    """Decode image_path once and yield (profile, image) for every output profile, largest first.
+
+    JPEGs are decoded through Pillow's draft mode straight at the 1/2, 1/4 or 1/8
+    scale closest to the largest requested profile, so smaller outputs never pay
+    for a full-resolution decode. Renditions are downscaled progressively, each
+    from the clean (not yet composited) next larger one, so a thumbnail resamples
+    a 2048px copy instead of the whole frame. Consume each rendition before asking
+    for the next: only it and the next one's clean pixels are held at a time.
+    Time spent per stage is added to timer (a metrics.StageTimer) when given.
+    """
+    if timer is None:
+        timer = StageTimer()
+
+    profiles = job.profiles or [OutputProfile("full")]
+    with timer.stage('decode'):
+        source = Image.open(image_path)
+        full_width, full_height = source.size
+        targets = [profile.target_size(full_width, full_height) for profile in profiles]
+
+        if source.format == "JPEG":
+            largest = max(targets)
+            if largest != source.size:
+                source.draft(source.mode, largest)
+
+        image = native_base(source)
+    order = sorted(range(len(profiles)), key=lambda i: targets[i][0] * targets[i][1], reverse=True)
+    for position, index in enumerate(order):
+        target = targets[index]
+        with timer.stage('resize'):
+            if target != image.size:
+                image = image.resize(target, Image.Resampling.LANCZOS)
+
+            # Overlays draw in place, so derive the next rendition's clean pixels first
+            following = None
+            if position + 1 < len(order):
+                next_target = targets[order[position + 1]]
+                following = (image.copy() if next_target == target
+                             else image.resize(next_target, Image.Resampling.LANCZOS))
+
+        scale = target[0] / full_width
+        yield profiles[index], apply_overlays(image, watermark, header, footer,
+                                              scaled_job(job, scale), overlay_cache, scale, timer)
+        image = following
+
+
+def render_frames(image_path, watermark, header, footer, job, overlay_cache=None, timer=None):
+    """Yield (profile, frames, timing) for every output profile of an animation or multi-page TIFF.
+
+    Every frame is composited with the overlays scaled for its size, which come
+    from overlay_cache, so an animation sizes and fades them once per profile
+    rather than once per frame. timing holds the per-frame duration list and
+    loop count to pass on to encode_frames.
+    """
+    if overlay_cache is None:
+        overlay_cache = OverlayCache()
+    if timer is None:
+        timer = StageTimer()
+
+    with timer.stage('decode'):
+        source = Image.open(image_path)
+    for profile in job.profiles or [OutputProfile("full")]:
+        frames, durations = [], []
+        for frame in timer.iterate(ImageSequence.Iterator(source), 'decode'):
+            with timer.stage('decode'):
+                image = native_base(frame.copy())
+            target = profile.target_size(*image.size)
+            with timer.stage('resize'):
+                if target != image.size:
+                    image = image.resize(target, Image.Resampling.LANCZOS)
+            scale = target[0] / frame.width
+            frames.append(apply_overlays(image, watermark, header, footer, scaled_job(job, scale),
+                                         overlay_cache, scale, timer))
+            durations.append(frame.info.get('duration', 0))
+        yield profile, frames, {'duration': durations if any(durations) else None, 'loop': source.info.get('loop')}
+
+
+def render_tiled(image_path, destinations, watermark, header, footer, job, overlay_cache=None, encoder=None,
+                 timer=None, image_format=None):
+    """Render a TIFF too large to decode whole, one band of rows at a time.
+
+    Full-size outputs are composited band by band and streamed as Deflate TIFFs
+    into temporary files next to their destinations; smaller renditions are
+    reduced band by band, finished with one LANCZOS resize, composited whole and
+    encoded in image_format like any other image. Returns (outputs,
+    encode_seconds) keyed by profile name, where a streamed output is the path of
+    its finished temporary file and any other is encoded bytes. On failure no
+    temporary file is left behind.
+    """
+    if overlay_cache is None:
+        overlay_cache = OverlayCache()
+    if timer is None:
+        timer = StageTimer()
+
+    bands = TiffBands(image_path)
+    width, height = bands.size
+    mode = "RGBA" if "A" in bands.mode else "RGB"
+    profiles = job.profiles or [OutputProfile("full")]
+    targets = {profile.name: profile.target_size(width, height) for profile in profiles}
+    reducers = {name: BandReducer(bands.size, mode, reduction_factor(bands.size, target))
+                for name, target in targets.items() if target != bands.size}
+    # Same size, same overlays: one set of flattened layers serves every band
+    placements = overlay_placements(width, height, watermark, header, footer, job, overlay_cache,
+                                    premultiplied=mode != "RGBA", timer=timer)
+    with timer.stage('overlay_prep'):
+        placements = overlay_cache.flattened(placements)
+    encode_seconds = dict.fromkeys(targets, 0.0)
+    writers = {}
+    try:
+        for name in targets.keys() - reducers.keys():
+            writers[name] = StripTiffWriter(temp_path(destinations[name]), bands.size, mode, bands.band_rows)
+
+        for top, band in timer.iterate(bands.bands(), 'decode'):
+            with timer.stage('decode'):
+                band = native_base(band)
+            # Reducers take the clean pixels; overlays are drawn at each rendition's own scale later
+            with timer.stage('resize'):
+                for reducer in reducers.values():
+                    reducer.feed(band)
+            if not writers:
+                continue
+
+            with timer.stage('composite'):
+                blend_placements(band, [(overlay, (x, y - top)) for overlay, (x, y) in placements
+                                        if y < top + band.height and y + overlay.height > top])
+            for name, writer in writers.items():
+                encode_started = time.perf_counter()
+                writer.write(band)
+                encode_seconds[name] += time.perf_counter() - encode_started
+
+        outputs = {}
+        for name, writer in writers.items():
+            writer.close()
+            outputs[name] = writer.path
+
+        for name, reducer in reducers.items():
+            with timer.stage('resize'):
+                image = reducer.result()
+                if image.size != targets[name]:
+                    image = image.resize(targets[name], Image.Resampling.LANCZOS)
+            scale = targets[name][0] / width
+            apply_overlays(image, watermark, header, footer, scaled_job(job, scale), overlay_cache, scale, timer)
+            encode_started = time.perf_counter()
+            outputs[name] = encode_output(image, image_path, encoder, image_format)
+            encode_seconds[name] = time.perf_counter() - encode_started
+    except BaseException:
+        # Also deletes the full-size files already closed, so a failed reduction leaves nothing in Done
+        for writer in writers.values():
+            writer.abort()
+        raise
+    return outputs, encode_seconds
+
+
+def estimate_render_bytes(header, data_size, job, frames=1):
+    """Peak memory of rendering one encoded image, estimated from its opened header without decoding pixels.
+
+    Counts the decoded frame in its source mode, the largest rendition plus the
+    next one derived from it, the largest encoded output and the compressed input
+    in the reader, in transit and in the worker; the composited frames of an
+    animation or multi-page TIFF are all held until it is encoded. Pillow keeps
+    every multi-band mode (RGB included) at four bytes per pixel. Errs on the high side.
+    """
+    width, height = header.size
+    targets = sorted((profile.target_size(width, height) for profile in job.profiles or [OutputProfile("full")]),
+                     key=lambda target: target[0] * target[1], reverse=True)
+    if header.format == "JPEG":
+        # Draft mode decodes at no more than twice the largest target per side
+        width, height = min(width, 2 * targets[0][0]), min(height, 2 * targets[0][1])
+
+    if header.mode in ("1", "L", "P"):
+        source_bytes = 1
+    elif header.mode.startswith("I;16"):
+        source_bytes = 2
+    else:
+        source_bytes = 4
+
+    renditions = [w * h * 4 for w, h in targets]
+    return (width * height * source_bytes + sum(renditions[:2]) + renditions[0] // 2 + 3 * data_size
+            + (frames - 1) * renditions[0])
+
+
+def estimate_tiled_bytes(header, job):
+    """Peak memory of render_tiled: a few bands in flight plus each smaller rendition as it is reduced"""
+    width, height = header.size
+    total = 3 * width * band_rows(header) * 4
+    for profile in job.profiles or [OutputProfile("full")]:
+        target = profile.target_size(width, height)
+        if target != header.size:
+            factor = reduction_factor(header.size, target)
+            total += (-(-width // factor) * -(-height // factor) + target[0] * target[1]) * 4
+    return total
+
+
+def memory_budget(job):
+    """Bytes of images the pool may hold at once: memory_budget_mb, else half the physical memory"""
+    if job.memory_budget_mb:
+        return job.memory_budget_mb * 1024 ** 2
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES') // 2
+    except (AttributeError, ValueError, OSError):
+        # No sysconf (Windows): admit by worker count alone
+        return None
+
+
+def native_base(image):
+    """Image ready for compositing without a whole-frame RGBA round trip.
+
+    RGB and RGBA sources are used as decoded; other modes only get converted to
+    RGB (or RGBA when they carry transparency) so colored overlays stay colored.
+    """
+    if image.mode in ("RGB", "RGBA"):
+        image.load()
+        return image
+    if "A" in image.getbands() or "transparency" in image.info:
+        return image.convert("RGBA")
+    return image.convert("RGB")
+
+
+def blend_overlay(base, overlay, position):
+    """Alpha-blend an RGBA overlay into base, touching only the overlay's bounding box"""
+    if base.mode != "RGBA":
+        # Masked paste blends just the box and leaves the base in its own mode;
+        # premultiplied overlays skip the multiply by alpha on the overlay side
+        base.paste(overlay, position, overlay)
+        return
+
+    if overlay.mode == "RGBa":
+        overlay = overlay.convert("RGBA")
+
+    # RGBA bases need a true "over" so their own transparency is kept
+    x, y = position
+    left, top = max(0, -x), max(0, -y)
+    right = min(overlay.width, base.width - x)
+    bottom = min(overlay.height, base.height - y)
+    if right > left and bottom > top:
+        base.alpha_composite(overlay, dest=(x + left, y + top), source=(left, top, right, bottom))
+
+
+def blend_placements(base, placements):
+    """Blend (overlay, position) pairs onto base in paint order"""
+    for overlay, position in placements:
+        blend_overlay(base, overlay, position)
+
+
+def scaled_job(job, scale):
+    """Job with pixel margins and font size scaled to match a downsized rendition"""
+    if scale == 1.0:
+        return job
+    return replace(job,
+                   footer_margin=round(job.footer_margin * scale),
+                   footer_bottom_margin=round(job.footer_bottom_margin * scale),
+                   header_top_margin=round(job.header_top_margin * scale),
+                   font_size=max(1, round(job.font_size * scale)))
+
+
+def overlay_placements(raw_width, raw_height, watermark, header, footer, job, overlay_cache=None, scale=1.0,
+                       premultiplied=True, timer=None):
+    """(overlay, position) for header, footer, watermark and text on a raw_width x raw_height base, in paint order.
+
+    Overlays come scaled (and faded) from overlay_cache, so every frame, page or
+    band of the same size reuses them. premultiplied must be False for RGBA bases.
+    Preparation time is charged to timer's overlay_prep and text stages.
+    """
+    if overlay_cache is None:
+        overlay_cache = OverlayCache()
+    if timer is None:
+        timer = StageTimer()
+
+    placements = []
+    with timer.stage('overlay_prep'):
+        overlay_width = raw_width - 2 * job.footer_margin
+
+        # Header
+        if header:
+            resized_header = overlay_cache.scaled(header, overlay_width, (job.footer_margin, job.header_top_margin),
+                                                  premultiplied=premultiplied)
+            placements.append((resized_header, (job.footer_margin, job.header_top_margin)))
+
+        # Footer
+        if footer:
+            resized_footer = overlay_cache.scaled(footer, overlay_width, (job.footer_margin, job.footer_bottom_margin),
+                                                  premultiplied=premultiplied)
+            footer_y = raw_height - resized_footer.height - job.footer_bottom_margin
+            placements.append((resized_footer, (job.footer_margin, footer_y)))
+
+        # Watermark (centered); renditions shrink it along with the image
+        if watermark:
+            watermark = overlay_cache.scaled(watermark, max(1, round(watermark.width * scale)),
+                                             opacity=watermark_opacity(job), premultiplied=premultiplied)
+            wm_x = (raw_width - watermark.width) // 2
+            wm_y = job.header_top_margin + (resized_header.height if header else 0) + round(20 * scale)
+            if raw_height < 600 * scale:
+                wm_y += round(100 * scale)
+            placements.append((watermark, (wm_x, wm_y)))
+
+    # Custom text with advanced styling
+    if job.add_text and job.custom_text.strip():
+        with timer.stage('text'):
+            placements.append(text_placement(raw_width, raw_height, job, overlay_cache, scale))
+
+    return placements
+
+
+def apply_overlays(raw_image, watermark, header, footer, job, overlay_cache=None, scale=1.0, timer=None):
+    """Paste header, footer, watermark and text onto raw_image in place and return it.
+
+    Overlapping overlays (typically text over the footer) are flattened into one
+    layer, cached alongside the scaled overlays, so a batch of same-size images
+    blends each region once and builds the layers only for the first image.
+    """
+    if overlay_cache is None:
+        overlay_cache = OverlayCache()
+    if timer is None:
+        timer = StageTimer()
+
+    # RGBA bases need straight alpha for alpha_composite; everything else blends premultiplied
+    placements = overlay_placements(raw_image.width, raw_image.height, watermark, header, footer,
+                                    job, overlay_cache, scale, premultiplied=raw_image.mode != "RGBA", timer=timer)
+    with timer.stage('overlay_prep'):
+        layers = overlay_cache.flattened(placements)
+    with timer.stage('composite'):
+        blend_placements(raw_image, layers)
+    return raw_image
+
+
+def load_font(job):
+    """Load the TrueType font matching the bold/italic settings, with fallbacks"""
+    try:
+        font_style = "arial.ttf"
+        if job.text_bold and job.text_italic:
+            font_style = "arialbi.ttf"
+        elif job.text_bold:
+            font_style = "arialbd.ttf"
+        elif job.text_italic:
+            font_style = "ariali.ttf"
+
+        return ImageFont.truetype(font_style, job.font_size)
+    except:
+        try:
+            return ImageFont.truetype("calibri.ttf", job.font_size)
+        except:
+            return ImageFont.load_default()
+
+
+def _text_layer(size, color, draw):
+    """One solid-color RGBA layer whose alpha is whatever draw(mask_draw) paints.
+
+    Painting a coverage mask and attaching it as alpha keeps anti-aliased edges in
+    the layer's own color instead of fading them towards transparent black.
+    """
+    mask = Image.new("L", size, 0)
+    draw(ImageDraw.Draw(mask))
+    layer = Image.new("RGBA", size, color)
+    layer.putalpha(mask)
+    return layer
+
+
+def render_text_sprite(job):
+    """Render the styled text block (background, shadow, outline, text) once.
+
+    Returns (sprite, bbox, margin): the RGBA sprite, the text's own bounding box
+    used for positioning, and how far the sprite extends past the text origin.
+    """
+    text = job.custom_text.strip()
+    font = load_font(job)
+    bbox = ImageDraw.Draw(Image.new("L", (1, 1))).textbbox((0, 0), text, font=font)
+    text_width, text_height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+    padding = 10 if job.text_background else 0
+    shadow_offset = max(2, job.font_size // 15) if job.text_shadow else 0
+    outline_width = max(1, job.font_size // 20) if job.text_outline else 0
+
+    margin = max(padding, outline_width)
+    size = (max(bbox[2], text_width + padding) + margin + outline_width + shadow_offset + 1,
+            max(bbox[3], text_height + padding) + margin + outline_width + shadow_offset + 1)
+    origin = (margin, margin)
+
+    sprite = Image.new("RGBA", size, (0, 0, 0, 0))
+
+    # Add background if enabled
+    if job.text_background:
+        bg_bbox = (margin - padding, margin - padding,
+                   margin + text_width + padding, margin + text_height + padding)
+        sprite.alpha_composite(_text_layer(size, job.text_bg_color,
+                                           lambda d: d.rectangle(bg_bbox, fill=255)))
+
+    # Add shadow if enabled
+    if job.text_shadow:
+        shadow_origin = (margin + shadow_offset, margin + shadow_offset)
+        sprite.alpha_composite(_text_layer(size, "#000000",
+                                           lambda d: d.text(shadow_origin, text, fill=255, font=font)))
+
+    # Add outline if enabled, using Pillow's stroke instead of re-drawing the text per offset
+    if job.text_outline:
+        sprite.alpha_composite(_text_layer(size, job.text_outline_color,
+                                           lambda d: d.text(origin, text, fill=255, font=font,
+                                                            stroke_width=outline_width, stroke_fill=255)))
+
+    # Draw main text
+    sprite.alpha_composite(_text_layer(size, job.text_color,
+                                       lambda d: d.text(origin, text, fill=255, font=font)))
+    return sprite, bbox, margin
+
+
+def text_sprite_key(job):
+    """Every setting that changes how the text block looks (but not where it goes)"""
+    return ('text', job.custom_text.strip(), job.font_size, job.text_bold, job.text_italic,
+            job.text_shadow, job.text_background, job.text_outline,
+            job.text_color, job.text_bg_color, job.text_outline_color)
+
+
+def text_placement(image_width, image_height, job, overlay_cache=None, scale=1.0):
+    """(sprite, position) of the styled text block on an image of this size, for a rendition at scale"""
+    if overlay_cache is None:
+        overlay_cache = OverlayCache()
+
+    sprite, bbox, margin = overlay_cache.cached(text_sprite_key(job), lambda: render_text_sprite(job))
+    text_x, text_y = get_text_position(image_width, image_height, bbox, job.text_position,
+                                       round(TEXT_MARGIN * scale))
+    return sprite, (text_x - margin, text_y - margin)
+
+
+def add_styled_text(image, job, overlay_cache=None):
+    """Add styled text to image with advanced options.
+
+    The text block is rendered into a sprite once per distinct text style and
+    reused from overlay_cache, so each image only pays for one blend.
+    """
+    blend_overlay(image, *text_placement(image.width, image.height, job, overlay_cache))
+
+
+def watermark_batch(src, dst, archive, settings, on_start=None, on_result=None, log=None,
+                    state_dir=DEFAULT_STATE_DIR, output_cache_bytes=DEFAULT_MAX_BYTES):
+    """Watermark every supported image in src into dst and archive the originals.
+
+    Images are fed to the pipeline as the input folder is scanned (see
+    discovery.iter_images), so work starts before a large inbox is fully listed.
+    on_start(total) is called once the scan has finished, on_result(result,
+    completed, total) with a TaskResult after each image finishes (in completion
+    order, total counting the images found so far while the scan runs) and
+    log(message) for non-fatal warnings. Progress is recorded in a job manifest under
+    state_dir (None disables it) so a rerun skips images that were already rendered
+    with the same content and settings, and finished outputs are kept in a
+    content-addressed cache of up to output_cache_bytes (0 disables it) so the same
+    content under any name is copied instead of rendered. With settings.distributed
+    each image is claimed first and only the images this node won are counted and
+    processed (see claims.ClaimBox). Returns a BatchSummary.
+    """
+    for directory in [dst, archive] + [profile_dir(dst, p, settings) for p in settings.profiles]:
+        os.makedirs(directory, exist_ok=True)
+
+    summary = BatchSummary()
+    with claiming(src, settings, log) as claims:
+        image_files = iter_images(src, settings.recursive, settings.input_shard(),
+                                  exclude=[dst, archive] + ([state_dir] if state_dir else []))
+        if claims:
+            image_files = (name for name in image_files if claims.claim(name))
+        first = next(image_files, None)
+        if first is None:
+            if on_start:
+                on_start(0)
+            return summary
+
+        def feed(pipeline):
+            try:
+                # Counted before submitting, so a result never arrives ahead of its count
+                summary.total = 1
+                pipeline.submit(first)
+                for image_file in image_files:
+                    summary.total += 1
+                    pipeline.submit(image_file)
+            finally:
+                pipeline.close()
+            if on_start:
+                on_start(summary.total)
+
+        # A claimed image is read from, and archived out of, this node's claim folder
+        with running_pipeline(claims.directory if claims else src, dst, archive, settings, log, state_dir,
+                              output_cache_bytes, manifest_root=src) as pipeline:
+            threading.Thread(target=feed, args=(pipeline,), daemon=True).start()
+
+            for completed, result in enumerate(pipeline.results(), start=1):
+                summary.record(result)
+
+                if on_result:
+                    on_result(result, completed, summary.total)
+
+            summary.pipeline = pipeline.report()
+
+    return summary
+
+
+def watch_inbox(src, dst, archive, settings, stop_event, on_result=None, log=None,
+                queue_size=None, settle_seconds=2.0, poll_interval=1.0, state_dir=DEFAULT_STATE_DIR,
+                output_cache_bytes=DEFAULT_MAX_BYTES):
+    """Continuously watermark images as they finish arriving in src until stop_event is set.
+
+    Settled files flow into the pipeline's bounded queues (queue_size deep, default
+    two per worker), so a burst of uploads blocks the watcher instead of growing
+    memory. on_result(result, completed, total) uses completed + still queued/in
+    flight as the running total. With settings.recursive subfolders are watched
+    too. With settings.distributed each settled file is claimed before it is
+    queued, and files another node claimed first are skipped.
+    Returns a BatchSummary for the whole session.
+    """
+    for directory in [src, dst, archive] + [profile_dir(dst, p, settings) for p in settings.profiles]:
+        os.makedirs(directory, exist_ok=True)
+
+    summary = BatchSummary()
+    watcher = InboxWatcher(src, settle_seconds=settle_seconds, poll_interval=poll_interval,
+                           shard=settings.input_shard(), recursive=settings.recursive,
+                           exclude=[dst, archive] + ([state_dir] if state_dir else []))
+
+    with claiming(src, settings, log) as claims, \
+            running_pipeline(claims.directory if claims else src, dst, archive, settings, log, state_dir,
+                             output_cache_bytes, depth=queue_size, manifest_root=src) as pipeline:
+        def emit(name):
+            if claims and not claims.claim(name):
+                watcher.done(name)
+                return True
+            while not stop_event.is_set():
+                try:
+                    pipeline.submit(name, timeout=0.5)
+                    return True
+                except queue.Full:
+                    continue
+            if claims:
+                claims.release(name)
+            return False
+
+        def watch():
+            try:
+                watcher.run(emit, stop_event)
+            finally:
+                pipeline.close()
+
+        threading.Thread(target=watch, daemon=True).start()
+
+        for result in pipeline.results():
+            summary.record(result)
+            summary.total += 1
+            watcher.done(result.image_file, failed=result.error is not None)
+
+            if on_result:
+                on_result(result, summary.total, summary.total + pipeline.pending)
+
+        summary.pipeline = pipeline.report()
+
+    return summary
+
+
+def prepare_overlays(settings, log=None):
+    """Load the watermark, header and footer assets ready to ship to workers"""
+    watermark = load_asset(settings.watermark_path, log)
+    header = load_asset(settings.header_path, log)
+    footer = load_asset(settings.footer_path, log)
+
+    # Opacity is applied by each worker's overlay cache after scaling
+    # Fingerprint once here so workers receive the hashes with the pickled assets
+    for asset in (watermark, header, footer):
+        if asset:
+            asset_fingerprint(asset)
+
+    return watermark, header, footer
+
+
+@contextmanager
+def claiming(src, settings, log=None):
+    """A started ClaimBox on src when settings.distributed, else None; closing it returns unfinished claims"""
+    if not settings.distributed:
+        yield None
+        return
+
+    claims = ClaimBox(src, settings.node_name or None, settings.claim_timeout).start()
+    try:
+        yield claims
+    finally:
+        claims.close()
+        if claims.recovered and log:
+            log(f"♻️ Returned {claims.recovered} images claimed by stale nodes to {src}")
+
+
+@contextmanager
+def running_pipeline(src, dst, archive, settings, log=None, state_dir=None, output_cache_bytes=0, depth=None,
+                     manifest_root=None):
+    """Start the worker pool and the staged pipeline around it.
+
+    Images are read from src; manifest entries are keyed under manifest_root
+    (default src), so claimed images keep the key of their place in the inbox.
+
+    The prepared overlays ship once per worker, not per task. Images are admitted
+    to the pool against the job's memory budget, using estimates from their
+    headers; single TIFFs too large for the budget are streamed band by band. On
+    exit the manifest is closed, the output cache trimmed back to its size budget
+    and, when settings.profiling is set, the per-image profiles merged.
+    """
+    check_encoder(settings.encoder_profile())
+    overlays = prepare_overlays(settings, log)
+    manifest = JobManifest(os.path.join(state_dir, "manifest.sqlite")) if state_dir else None
+    output_cache = None
+    if state_dir and output_cache_bytes:
+        output_cache = OutputCache(os.path.join(state_dir, "outputs"), output_cache_bytes)
+
+    workers = max(1, settings.workers)
+    budget = memory_budget(settings)
+    profiler = None
+    if settings.profiling > 0:
+        # The counter is inherited by every worker, so the first N images are profiled wherever they run
+        profiling_dir = settings.profiling_dir or os.path.join(state_dir or DEFAULT_STATE_DIR, "profiles")
+        profiler = ImageProfiler(run_folder(profiling_dir), settings.profiling, multiprocessing.Value('i', 0))
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=_init_worker,
+                                 initargs=(*overlays, settings, profiler)) as executor:
+            pipeline = Pipeline(executor, workers, _render_task,
+                                plan=lambda path: plan_source(path, settings, budget),
+                                destinations=lambda image_file, plan: output_destinations(
+                                    image_file, dst, settings, plan.output_format, plan.profile_formats),
+                                new_result=lambda image_file: TaskResult(image_file),
+                                src=src, archive=archive,
+                                settings_digest=settings_hash(settings, overlays),
+                                manifest=manifest, output_cache=output_cache, depth=depth,
+                                archivers=max(1, settings.archive_threads), memory_budget=budget,
+                                manifest_root=manifest_root)
+            yield pipeline.start()
+    finally:
+        if manifest:
+            manifest.close()
+        if output_cache:
+            output_cache.evict()
+        if profiler:
+            profiled = combine(profiler.folder)
+            if log:
+                log(f"🔬 Profiled {profiled} images: {profiler.folder}")
@@ -1,11 +1,35 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, colorchooser, messagebox, font
-from PIL import Image, ImageEnhance, ImageDraw, ImageFont, ImageTk
+from PIL import Image, ImageTk
 import os
+import queue
 import shutil
 from pathlib import Path
 import threading
 from datetime import datetime
+from itertools import islice
+
+from engine import WatermarkJob, OutputProfile, ENCODER_PROFILES, DEFAULT_STATE_DIR, watermark_batch, watch_inbox
+from metrics import write_json
+from discovery import iter_images
+from preview import PreviewRenderer
+
+
+# Longest edge of the live preview proxy, how long settings must rest before it re-renders,
+# and how many RAW images the preview cycles through
+PREVIEW_EDGE = 360
+PREVIEW_DEBOUNCE_MS = 120
+PREVIEW_SAMPLES = 20
+
+# How often queued log lines and progress reach the window, how many lines the status view keeps,
+# and where the complete log goes
+UI_FRAME_MS = 50
+LOG_VIEW_LINES = 500
+LOG_FILE = "watermark.log"
+# Images profiled when "Profile run" is ticked
+PROFILED_IMAGES = 10
+# JSON report of the latest batch or watch session: counts, stage timing histograms, pipeline, encoding
+RUN_REPORT = os.path.join(DEFAULT_STATE_DIR, "last-run.json")
 
 
 class ModernWatermarkApp:
@@ -19,8 +43,25 @@ class ModernWatermarkApp:
         self.assets_dir = Path("assets")
         self.assets_dir.mkdir(exist_ok=True)
 
+        # Set while watch mode is running; setting it stops the watcher
+        self.watch_stop = None
+        # True while a batch runs; a batch and a watcher must never share RAW, Done and Archive
+        self.batch_running = False
+
+        # Live preview of the current settings on a sample from RAW
+        self.preview_renderer = PreviewRenderer(max_edge=PREVIEW_EDGE)
+        self.preview_after = None
+        self.preview_index = 0
+
+        # Background threads never touch Tk directly; they queue events that drain_ui_events applies each frame
+        self.ui_events = queue.Queue()
+        self.log_file = open(LOG_FILE, 'a', encoding='utf-8')
+
         self.create_widgets()
         self.load_existing_assets()
+        self.watch_preview_variables()
+        self.schedule_preview()
+        self.root.after(UI_FRAME_MS, self.drain_ui_events)
 
 
 
@@ -56,6 +97,12 @@ class ModernWatermarkApp:
         self.text_position = tk.StringVar(value="bottom-left")
         self.text_outline = tk.BooleanVar(value=False)
         self.text_outline_color = tk.StringVar(value="#000000")
+        self.workers = tk.IntVar(value=os.cpu_count() or 1)
+        self.encoder = tk.StringVar(value="default")
+        # Comma-separated OutputProfile specs, e.g. "master, web:2048, thumb:400"; empty writes one full-size copy
+        self.renditions = tk.StringVar()
+        self.include_subfolders = tk.BooleanVar(value=False)
+        self.profile_run = tk.BooleanVar(value=False)
 
     def setup_styles(self):
         # Configure ttk styles for modern look
@@ -160,6 +207,7 @@ class ModernWatermarkApp:
 
         # Create cards
         self.create_asset_card(left_column)
+        self.create_preview_card(left_column)
         self.create_text_card(middle_column)
         self.create_settings_card(middle_column)
         self.create_actions_card(right_column)
@@ -258,6 +306,32 @@ class ModernWatermarkApp:
                                cursor='hand2')
         choose_btn.pack(side='right')
 
+    def create_preview_card(self, parent):
+        def create_preview_content(content_frame):
+            self.preview_label = tk.Label(content_frame,
+                                          text="Add an image to RAW to preview",
+                                          bg='#1a1a3a', fg='#9ca3af',
+                                          font=('Segoe UI', 10))
+            self.preview_label.pack(fill='both', expand=True, padx=15, pady=(15, 8))
+
+            info_frame = tk.Frame(content_frame, bg='#2a2a4a')
+            info_frame.pack(fill='x', padx=15, pady=(0, 15))
+
+            self.preview_info = tk.Label(info_frame, text="", bg='#2a2a4a', fg='#a0a0c0',
+                                         font=('Segoe UI', 9))
+            self.preview_info.pack(side='left')
+
+            next_btn = tk.Button(info_frame,
+                                 text="🔄 Next Sample",
+                                 command=self.next_preview_sample,
+                                 bg='#6b7280', fg='white', relief='flat',
+                                 font=('Segoe UI', 9, 'bold'), cursor='hand2',
+                                 activebackground='#4b5563', activeforeground='white')
+            next_btn.pack(side='right')
+
+        card = self.create_modern_card(parent, "Live Preview", "🖼️", ("#0891b2", "#0e7490"), create_preview_content)
+        card.pack(fill='both', expand=True)
+
     def create_text_card(self, parent):
         def create_text_content(content_frame):
             # Text enable checkbox
@@ -451,7 +525,8 @@ class ModernWatermarkApp:
             margins = [
                 ("Side", self.footer_margin, "#f59e0b"),
                 ("Bottom", self.footer_bottom_margin, "#ef4444"),
-                ("Top", self.header_top_margin, "#10b981")
+                ("Top", self.header_top_margin, "#10b981"),
+                ("Workers", self.workers, "#06b6d4")
             ]
 
             for i, (label, var, color) in enumerate(margins):
@@ -469,6 +544,48 @@ class ModernWatermarkApp:
             margin_grid.grid_columnconfigure(0, weight=1)
             margin_grid.grid_columnconfigure(1, weight=1)
             margin_grid.grid_columnconfigure(2, weight=1)
+            margin_grid.grid_columnconfigure(3, weight=1)
+
+            # Output encoding
+            encoder_frame = tk.Frame(content_frame, bg='#2a2a4a')
+            encoder_frame.pack(fill='x', padx=15, pady=(0, 15))
+
+            tk.Label(encoder_frame, text="🗜️ Encoder:", bg='#2a2a4a', fg='white',
+                     font=('Segoe UI', 11, 'bold')).pack(side='left')
+
+            encoder_menu = tk.OptionMenu(encoder_frame, self.encoder, *ENCODER_PROFILES)
+            encoder_menu.configure(bg='#1a1a3a', fg='white', relief='flat', highlightthickness=0,
+                                   activebackground='#7c3aed', activeforeground='white',
+                                   font=('Segoe UI', 10), cursor='hand2')
+            encoder_menu.pack(side='left', padx=(10, 0))
+
+            tk.Checkbutton(encoder_frame, text="📂 Include subfolders", variable=self.include_subfolders,
+                           bg='#2a2a4a', fg='white', selectcolor='#1a1a3a',
+                           font=('Segoe UI', 10, 'bold'),
+                           activebackground='#2a2a4a', activeforeground='white',
+                           cursor='hand2').pack(side='right')
+
+            tk.Checkbutton(encoder_frame, text=f"🔬 Profile run ({PROFILED_IMAGES} images)",
+                           variable=self.profile_run,
+                           bg='#2a2a4a', fg='white', selectcolor='#1a1a3a',
+                           font=('Segoe UI', 10, 'bold'),
+                           activebackground='#2a2a4a', activeforeground='white',
+                           cursor='hand2').pack(side='right', padx=(0, 10))
+
+            # Renditions written per input, each into its own subfolder of Done
+            renditions_frame = tk.Frame(content_frame, bg='#2a2a4a')
+            renditions_frame.pack(fill='x', padx=15, pady=(0, 15))
+
+            tk.Label(renditions_frame, text="🖼️ Renditions:", bg='#2a2a4a', fg='white',
+                     font=('Segoe UI', 11, 'bold')).pack(anchor='w')
+
+            tk.Entry(renditions_frame, textvariable=self.renditions,
+                     bg='#1a1a3a', fg='white', relief='flat',
+                     font=('Segoe UI', 11), bd=0,
+                     insertbackground='white').pack(fill='x', pady=(8, 0), ipady=6)
+
+            tk.Label(renditions_frame, text="e.g. master, web:2048, thumb:400 (empty: one full-size copy)",
+                     bg='#2a2a4a', fg='#a0a0c0', font=('Segoe UI', 9)).pack(anchor='w', pady=(4, 0))
 
         card = self.create_modern_card(parent, "Settings", "⚙️", ("#7c3aed", "#6d28d9"), create_settings_content)
         card.pack(fill='x')
@@ -499,6 +616,16 @@ class ModernWatermarkApp:
                                          activebackground='#059669', activeforeground='white')
             self.process_btn.pack(fill='x', padx=20, pady=8)
 
+            # Watch mode toggle
+            self.watch_btn = tk.Button(button_frame,
+                                       text="👁️ Watch RAW Folder",
+                                       command=self.toggle_watch,
+                                       bg='#3b82f6', fg='white', relief='flat',
+                                       font=('Segoe UI', 12, 'bold'),
+                                       cursor='hand2',
+                                       activebackground='#2563eb', activeforeground='white')
+            self.watch_btn.pack(fill='x', padx=20, pady=8)
+
             # Quick actions
             quick_frame = tk.Frame(button_frame, bg='#2a2a4a')
             quick_frame.pack(fill='x', padx=20, pady=(15, 0))
@@ -532,6 +659,8 @@ class ModernWatermarkApp:
                                        font=('Consolas', 10),
                                        wrap='word')
             self.status_text.pack(fill='both', expand=True, padx=15, pady=(15, 10))
+            for color in ("#10b981", "#ef4444", "#3b82f6", "#8b5cf6", "#e5e7eb"):
+                self.status_text.tag_configure(color, foreground=color)
 
             # Progress section
             progress_frame = tk.Frame(content_frame, bg='#2a2a4a')
@@ -614,7 +743,7 @@ class ModernWatermarkApp:
         file_path = filedialog.askopenfilename(
             title=f"Choose {asset_type.title()} Image",
             filetypes=[
-                ("Image files", "*.png *.jpg *.jpeg *.bmp *.gif *.tiff *.webp"),
+                ("Image files", "*.png *.jpg *.jpeg *.bmp *.gif *.tif *.tiff *.webp"),
                 ("PNG files", "*.png"),
                 ("JPEG files", "*.jpg *.jpeg"),
                 ("All files", "*.*")
@@ -732,6 +861,62 @@ class ModernWatermarkApp:
         for i in range(3):
             gallery_frame.grid_columnconfigure(i, weight=1)
 
+    def watch_preview_variables(self):
+        """Refresh the preview whenever a setting that shapes the output changes"""
+        variables = [
+            self.watermark_path, self.header_path, self.footer_path,
+            self.custom_text, self.text_color, self.text_bg_color, self.text_outline_color,
+            self.opacity, self.footer_margin, self.footer_bottom_margin, self.header_top_margin,
+            self.font_size, self.add_text, self.text_bold, self.text_italic, self.text_shadow,
+            self.text_background, self.text_position, self.text_outline
+        ]
+        for var in variables:
+            var.trace_add('write', self.schedule_preview)
+
+    def schedule_preview(self, *_):
+        """Debounce preview refreshes so a slider drag renders once it pauses, not per step"""
+        if self.preview_after is not None:
+            self.root.after_cancel(self.preview_after)
+        self.preview_after = self.root.after(PREVIEW_DEBOUNCE_MS, self.refresh_preview)
+
+    def next_preview_sample(self):
+        """Preview the next image waiting in RAW"""
+        self.preview_index += 1
+        self.schedule_preview()
+
+    def refresh_preview(self):
+        """Hand the current settings to the background preview renderer"""
+        self.preview_after = None
+        # A bounded sample, so a huge inbox is not rescanned on every settings change
+        samples = sorted(islice(iter_images("RAW", self.include_subfolders.get()), PREVIEW_SAMPLES))
+        if not samples:
+            self.preview_label.configure(image='', text="Add an image to RAW to preview")
+            self.preview_label.image = None
+            self.preview_info.configure(text="")
+            return
+
+        try:
+            job = self.build_job()
+        except (tk.TclError, ValueError):
+            # A numeric entry or the renditions list is mid-edit (e.g. empty); keep the last preview
+            return
+
+        sample = samples[self.preview_index % len(samples)]
+        self.preview_renderer.request(
+            os.path.join("RAW", sample), job,
+            lambda image, seconds, error: self.call_in_ui(self.show_preview, sample, image, seconds, error))
+
+    def show_preview(self, sample, image, seconds, error):
+        """Display a finished preview render (runs on the Tk thread)"""
+        if error is not None:
+            self.preview_info.configure(text=f"⚠️ {sample[:30]}: {error}")
+            return
+
+        photo = ImageTk.PhotoImage(image)
+        self.preview_label.configure(image=photo, text='')
+        self.preview_label.image = photo
+        self.preview_info.configure(text=f"{sample[:30]} · {seconds * 1000:.0f} ms")
+
     def reset_settings(self):
         """Reset all settings to defaults"""
         self.opacity.set(80.0)
@@ -750,6 +935,11 @@ class ModernWatermarkApp:
         self.text_background.set(False)
         self.text_outline.set(False)
         self.text_position.set("bottom-left")
+        self.workers.set(os.cpu_count() or 1)
+        self.encoder.set("default")
+        self.renditions.set("")
+        self.include_subfolders.set(False)
+        self.profile_run.set(False)
 
         # Update color buttons
         self.text_color_btn.configure(bg="#FFFFFF")
@@ -781,262 +971,287 @@ class ModernWatermarkApp:
                                 "📁 All directories already exist.\n\n🎯 Place your images in the 'RAW' folder to process them.")
 
     def log_status(self, message):
-        """Add a message to the status log with timestamp and colors"""
+        """Queue a timestamped message for the status log; safe to call from any thread"""
         timestamp = datetime.now().strftime("%H:%M:%S")
+        self.ui_events.put(('log', f"[{timestamp}] {message}\n"))
+
+    def update_progress(self, value):
+        """Queue a progress bar update; only the latest one per frame is drawn"""
+        self.ui_events.put(('progress', value))
 
-        self.status_text.configure(state='normal')
+    def set_progress_text(self, text):
+        """Queue a progress label update; only the latest one per frame is drawn"""
+        self.ui_events.put(('progress_text', text))
 
-        # Color coding for different message types
+    def call_in_ui(self, func, *args):
+        """Run func(*args) on the Tk thread at the next frame"""
+        self.ui_events.put(('call', func, args))
+
+    @staticmethod
+    def log_color(message):
+        """Color coding for different message types"""
         if "✅" in message or "🎉" in message:
-            color = "#10b981"
+            return "#10b981"
         elif "❌" in message or "⚠️" in message:
-            color = "#ef4444"
+            return "#ef4444"
         elif "📁" in message or "🚀" in message:
-            color = "#3b82f6"
+            return "#3b82f6"
         elif "✏️" in message:
-            color = "#8b5cf6"
-        else:
-            color = "#e5e7eb"
+            return "#8b5cf6"
+        return "#e5e7eb"
 
-        # Insert with color (simplified for basic tkinter)
-        self.status_text.insert('end', f"[{timestamp}] {message}\n")
-        self.status_text.configure(state='disabled')
-        self.status_text.see('end')
-        self.root.update()
+    def drain_ui_events(self):
+        """Apply everything queued since the last frame in one redraw, then schedule the next frame.
 
-    def update_progress(self, value):
-        """Update the custom progress bar"""
-        if hasattr(self, 'progress_bg'):
-            total_width = self.progress_bg.winfo_width() - 2
-            fill_width = int(total_width * value)
-            self.progress_fill.place(width=fill_width)
-            self.root.update()
+        The cost per frame is bounded by LOG_VIEW_LINES no matter how many images
+        finished, and the status view never holds more than that many lines; the
+        log file receives every line.
+        """
+        try:
+            lines = []
+            progress = progress_text = None
+            try:
+                while True:
+                    event = self.ui_events.get_nowait()
+                    if event[0] == 'log':
+                        lines.append(event[1])
+                    elif event[0] == 'progress':
+                        progress = event[1]
+                    elif event[0] == 'progress_text':
+                        progress_text = event[1]
+                    else:
+                        _, func, args = event
+                        try:
+                            func(*args)
+                        except Exception as e:
+                            # One broken callback must not take the rest of the frame (or the UI loop) with it
+                            self.log_status(f"❌ UI update {getattr(func, '__name__', func)} failed: {e}")
+            except queue.Empty:
+                pass
+
+            if lines:
+                self.log_file.writelines(lines)
+                self.log_file.flush()
+
+                self.status_text.configure(state='normal')
+                for line in lines[-LOG_VIEW_LINES:]:
+                    self.status_text.insert('end', line, self.log_color(line))
+                self.status_text.delete('1.0', f'end - {LOG_VIEW_LINES + 1} lines')
+                self.status_text.configure(state='disabled')
+                self.status_text.see('end')
+
+            if progress is not None and hasattr(self, 'progress_bg'):
+                total_width = self.progress_bg.winfo_width() - 2
+                self.progress_fill.place(width=int(total_width * progress))
+            if progress_text is not None:
+                self.progress_label.configure(text=progress_text)
+        finally:
+            # Keep the frame loop alive whatever happened above
+            self.root.after(UI_FRAME_MS, self.drain_ui_events)
+
+    def log_result(self, result):
+        """Log the outcome of one image"""
+        if result.error is not None:
+            self.log_status(f"❌ Failed: {result.image_file} - {result.error}")
+        elif result.skipped:
+            self.log_status(f"⏭️ Unchanged, archived: {result.image_file}")
+        elif result.reused:
+            self.log_status(f"♻️ From output cache: {result.image_file}")
+        else:
+            self.log_status(f"✅ Processed: {result.image_file}")
+
+    def log_pipeline_report(self, report):
+        """Log per-stage utilization and queue depths of a finished run"""
+        for stage, stats in report.get('stages', {}).items():
+            feed = report['queues'][stage]
+            self.log_status(f"📊 {stage.title()}: {stats['utilization']:.0%} busy, "
+                            f"queue peak {feed['peak']}/{feed['capacity']}")
+        memory = report.get('memory')
+        if memory and memory['budget']:
+            self.log_status(f"📊 Memory: peak {memory['peak_reserved'] / 1024 ** 2:.0f} MB of "
+                            f"{memory['budget'] / 1024 ** 2:.0f} MB, {memory['deferred']} images waited")
+
+    def log_stage_report(self, summary, job):
+        """Log where per-image time went, stage by stage, and save the full run report"""
+        stages = summary.stage_times.ordered()
+        total = sum(histogram.sum for _, histogram in stages) or 1.0
+        for stage, histogram in stages:
+            self.log_status(f"⏱️ {stage.replace('_', ' ').title()}: "
+                            f"{histogram.quantile(0.5) * 1000:.0f} ms median, "
+                            f"{histogram.quantile(0.99) * 1000:.0f} ms p99, {histogram.sum / total:.0%} of image time")
+        try:
+            os.makedirs(DEFAULT_STATE_DIR, exist_ok=True)
+            write_json(RUN_REPORT, summary.report(job))
+            self.log_status(f"📝 Run report saved to {RUN_REPORT}")
+        except OSError as e:
+            self.log_status(f"⚠️ Could not save run report: {str(e)}")
+
+    def log_encoding_report(self, encoder, encoding):
+        """Log encode time and output size per output profile"""
+        for name, stats in encoding.items():
+            self.log_status(f"🗜️ Encoding {name} ({encoder}): "
+                            f"{stats['seconds'] / stats['images'] * 1000:.0f} ms/image, "
+                            f"{stats['bytes'] / 1024 ** 2:.1f} MB")
 
     def run_processing_threaded(self):
         """Run image processing in a separate thread"""
-        if not os.path.exists("RAW") or not os.listdir("RAW"):
+        if self.batch_running or self.watch_stop is not None:
+            return
+        # Tk variables are only read here, on the Tk thread
+        try:
+            job = self.build_job()
+        except (tk.TclError, ValueError) as e:
+            messagebox.showerror("Invalid Settings", f"⚠️ Please check the numeric settings and renditions: {str(e)}")
+            return
+
+        # Stops at the first image found rather than listing the whole folder
+        if next(iter_images("RAW", job.recursive), None) is None:
             messagebox.showwarning("No Images", "📂 No images found in RAW folder.\nPlease add images to process.")
             return
 
+        self.batch_running = True
         self.process_btn.configure(state='disabled', text="⏳ Processing...", bg='#6b7280')
+        self.watch_btn.configure(state='disabled', bg='#6b7280')
         self.update_progress(0)
-        self.progress_label.configure(text="Initializing processing...")
+        self.set_progress_text("Initializing processing...")
 
-        thread = threading.Thread(target=self.run_processing)
+        thread = threading.Thread(target=self.run_processing, args=(job,))
         thread.daemon = True
         thread.start()
 
-    def run_processing(self):
+    def run_processing(self, job):
         """Process images with enhanced watermarking"""
-        try:
-            raw_dir, done_dir, archive_dir = "RAW", "Done", "Archive"
-
-            for directory in [done_dir, archive_dir]:
-                os.makedirs(directory, exist_ok=True)
-
-            # Get supported image files
-            supported_formats = {'.jpg', '.jpeg', '.png', '.bmp', '.gif', '.tiff', '.webp'}
-            image_files = [f for f in os.listdir(raw_dir)
-                           if os.path.isfile(os.path.join(raw_dir, f))
-                           and Path(f).suffix.lower() in supported_formats]
-
-            total_files = len(image_files)
-
+        def on_start(total_files):
             if total_files == 0:
                 self.log_status("❌ No supported images found in RAW folder")
-                self.progress_label.configure(text="No images to process")
+                self.set_progress_text("No images to process")
                 return
 
-            self.log_status(f"🚀 Starting batch processing of {total_files} images...")
-            self.progress_label.configure(text=f"Processing {total_files} images...")
-
-            # Load assets
-            watermark = self.load_asset(self.watermark_path.get() or str(self.assets_dir / "watermark.png"))
-            header = self.load_asset(self.header_path.get() or str(self.assets_dir / "header.png"))
-            footer = self.load_asset(self.footer_path.get() or str(self.assets_dir / "footer.png"))
-
-            # Apply watermark opacity
-            if watermark:
-                opacity_decimal = self.opacity.get() / 100.0
-                watermark = self.apply_opacity(watermark, opacity_decimal)
-
-            processed_count = 0
-            failed_count = 0
-
-            for i, image_file in enumerate(image_files):
-                try:
-                    raw_image_path = os.path.join(raw_dir, image_file)
-
-                    # Update progress
-                    progress = (i + 1) / total_files
-                    self.update_progress(progress)
-                    self.progress_label.configure(text=f"Processing {i + 1}/{total_files}: {image_file[:30]}...")
-
-                    # Process image
-                    processed_image = self.process_single_image(
-                        raw_image_path, watermark, header, footer
-                    )
-
-                    # Save with optimized settings
-                    file_ext = Path(image_file).suffix.lower()
-                    if file_ext in ['.jpg', '.jpeg']:
-                        final_path = os.path.join(done_dir, image_file)
-                        processed_image.convert("RGB").save(final_path, "JPEG", quality=95, optimize=True)
-                    else:
-                        final_path = os.path.join(done_dir, f"{Path(image_file).stem}.png")
-                        processed_image.save(final_path, "PNG", optimize=True)
+            self.log_status(f"🔎 Found {total_files} images in RAW")
 
-                    # Archive original
-                    shutil.move(raw_image_path, os.path.join(archive_dir, image_file))
+        def on_result(result, completed, total_files):
+            # Update progress
+            self.update_progress(completed / total_files)
+            self.set_progress_text(f"Processing {completed}/{total_files}: {result.image_file[:30]}...")
+            self.log_result(result)
 
-                    processed_count += 1
-                    self.log_status(f"✅ Processed: {image_file}")
+        self.log_status(f"🚀 Starting batch processing with {job.workers} worker processes...")
+        try:
+            summary = watermark_batch("RAW", "Done", "Archive", job,
+                                      on_start=on_start, on_result=on_result, log=self.log_status)
 
-                except Exception as e:
-                    failed_count += 1
-                    self.log_status(f"❌ Failed: {image_file} - {str(e)}")
+            if summary.total == 0:
+                return
 
             # Final status
             self.update_progress(1.0)
-            if failed_count == 0:
+            self.log_status(f"📊 Overlay cache: {summary.cache_hits} hits / {summary.cache_misses} misses")
+            self.log_pipeline_report(summary.pipeline)
+            self.log_stage_report(summary, job)
+            self.log_encoding_report(job.encoder, summary.encoding)
+            if summary.failed == 0:
                 self.log_status(f"🎉 Batch processing completed successfully!")
-                self.log_status(f"📊 Processed: {processed_count} images")
-                self.progress_label.configure(text=f"✅ Complete! {processed_count} images processed")
+                self.log_status(f"📊 Processed: {summary.processed} images ({summary.skipped} unchanged, {summary.reused} from cache)")
+                self.set_progress_text(f"✅ Complete! {summary.processed} images processed")
             else:
-                self.log_status(f"⚠️ Processing completed with {failed_count} errors")
-                self.log_status(f"📊 Success: {processed_count}/{total_files}")
-                self.progress_label.configure(text=f"⚠️ Complete: {processed_count}/{total_files} successful")
+                self.log_status(f"⚠️ Processing completed with {summary.failed} errors")
+                self.log_status(f"📊 Success: {summary.processed}/{summary.total}")
+                self.set_progress_text(f"⚠️ Complete: {summary.processed}/{summary.total} successful")
 
         except Exception as e:
             self.log_status(f"❌ Critical error during processing: {str(e)}")
-            self.progress_label.configure(text="❌ Processing failed")
+            self.set_progress_text("❌ Processing failed")
         finally:
+            self.call_in_ui(self.finish_batch)
+
+    def finish_batch(self):
+        """Restore the action buttons once a batch has finished (runs on the Tk thread)"""
+        self.batch_running = False
+        if self.watch_stop is None:
             self.process_btn.configure(state='normal', text="🎯 Process Images", bg='#10b981')
+            self.watch_btn.configure(state='normal', bg='#3b82f6')
 
-    def load_asset(self, path):
-        """Load an asset image if it exists"""
-        if path and os.path.exists(path):
+    def toggle_watch(self):
+        """Start or stop continuous processing of images arriving in RAW"""
+        if self.watch_stop is None:
+            if self.batch_running:
+                return
             try:
-                return Image.open(path).convert("RGBA")
-            except Exception as e:
-                self.log_status(f"⚠️ Failed to load asset {Path(path).name}: {str(e)}")
-        return None
-
-    def apply_opacity(self, image, opacity):
-        """Apply opacity to an image"""
-        if image and 0 <= opacity <= 1:
-            image_copy = image.copy()
-            alpha = image_copy.split()[3]
-            alpha = ImageEnhance.Brightness(alpha).enhance(opacity)
-            image_copy.putalpha(alpha)
-            return image_copy
-        return image
-
-    def get_text_position(self, image_width, image_height, text_bbox):
-        """Calculate text position based on selection"""
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-        margin = 50
-
-        positions = {
-            "top-left": (margin, margin),
-            "top-center": ((image_width - text_width) // 2, margin),
-            "top-right": (image_width - text_width - margin, margin),
-            "center-left": (margin, (image_height - text_height) // 2),
-            "center": ((image_width - text_width) // 2, (image_height - text_height) // 2),
-            "center-right": (image_width - text_width - margin, (image_height - text_height) // 2),
-            "bottom-left": (margin, image_height - text_height - margin),
-            "bottom-center": ((image_width - text_width) // 2, image_height - text_height - margin),
-            "bottom-right": (image_width - text_width - margin, image_height - text_height - margin)
-        }
+                job = self.build_job()
+            except (tk.TclError, ValueError) as e:
+                messagebox.showerror("Invalid Settings", f"⚠️ Please check the numeric settings and renditions: {str(e)}")
+                return
+
+            self.watch_stop = threading.Event()
+            self.process_btn.configure(state='disabled', bg='#6b7280')
+            self.watch_btn.configure(text="⏹️ Stop Watching", bg='#ef4444')
+
+            thread = threading.Thread(target=self.run_watch, args=(job, self.watch_stop))
+            thread.daemon = True
+            thread.start()
+        else:
+            self.watch_stop.set()
+            self.watch_btn.configure(state='disabled', text="⏳ Stopping...")
+
+    def run_watch(self, job, stop_event):
+        """Process images from RAW as they arrive until watch mode is stopped"""
+        def on_result(result, completed, total):
+            self.update_progress(completed / total)
+            self.set_progress_text(f"👁️ Watching: {completed} done, {total - completed} queued")
+            self.log_result(result)
 
-        return positions.get(self.text_position.get(), positions["bottom-left"])
-
-    def process_single_image(self, image_path, watermark, header, footer):
-        """Process a single image with all overlays and advanced text styling"""
-        raw_image = Image.open(image_path).convert("RGBA")
-        raw_width, raw_height = raw_image.size
-
-        # Paste header
-        if header:
-            header_width = raw_width - 2 * self.footer_margin.get()
-            header_height = int(header.height * (header_width / header.width))
-            resized_header = header.resize((header_width, header_height), Image.Resampling.LANCZOS)
-            raw_image.paste(resized_header, (self.footer_margin.get(), self.header_top_margin.get()), resized_header)
-
-        # Paste footer
-        if footer:
-            footer_width = raw_width - 2 * self.footer_margin.get()
-            footer_height = int(footer.height * (footer_width / footer.width))
-            resized_footer = footer.resize((footer_width, footer_height), Image.Resampling.LANCZOS)
-            footer_y = raw_height - resized_footer.height - self.footer_bottom_margin.get()
-            raw_image.paste(resized_footer, (self.footer_margin.get(), footer_y), resized_footer)
-
-        # Paste watermark (centered)
-        if watermark:
-            wm_x = (raw_width - watermark.width) // 2
-            wm_y = self.header_top_margin.get() + (resized_header.height if header else 0) + 20
-            if raw_height < 600:
-                wm_y += 100
-            raw_image.paste(watermark, (wm_x, wm_y), watermark)
-
-        # Add custom text with advanced styling
-        if self.add_text.get() and self.custom_text.get().strip():
-            self.add_styled_text(raw_image)
-
-        return raw_image
-
-    def add_styled_text(self, image):
-        """Add styled text to image with advanced options"""
-        draw = ImageDraw.Draw(image)
-        text = self.custom_text.get().strip()
-
-        # Load font with style
         try:
-            font_style = "arial.ttf"
-            if self.text_bold.get() and self.text_italic.get():
-                font_style = "arialbi.ttf"
-            elif self.text_bold.get():
-                font_style = "arialbd.ttf"
-            elif self.text_italic.get():
-                font_style = "ariali.ttf"
-
-            font = ImageFont.truetype(font_style, self.font_size.get())
-        except:
-            try:
-                font = ImageFont.truetype("calibri.ttf", self.font_size.get())
-            except:
-                font = ImageFont.load_default()
-
-        # Get text bounding box
-        bbox = draw.textbbox((0, 0), text, font=font)
-        text_x, text_y = self.get_text_position(image.width, image.height, bbox)
-
-        # Add background if enabled
-        if self.text_background.get():
-            padding = 10
-            bg_bbox = (text_x - padding, text_y - padding,
-                       text_x + bbox[2] - bbox[0] + padding,
-                       text_y + bbox[3] - bbox[1] + padding)
-            draw.rectangle(bg_bbox, fill=self.text_bg_color.get())
-
-        # Add shadow if enabled
-        if self.text_shadow.get():
-            shadow_offset = max(2, self.font_size.get() // 15)
-            draw.text((text_x + shadow_offset, text_y + shadow_offset),
-                      text, fill="#000000", font=font)
-
-        # Add outline if enabled
-        if self.text_outline.get():
-            outline_width = max(1, self.font_size.get() // 20)
-            for adj_x in range(-outline_width, outline_width + 1):
-                for adj_y in range(-outline_width, outline_width + 1):
-                    if adj_x != 0 or adj_y != 0:
-                        draw.text((text_x + adj_x, text_y + adj_y),
-                                  text, fill=self.text_outline_color.get(), font=font)
-
-        # Draw main text
-        draw.text((text_x, text_y), text, fill=self.text_color.get(), font=font)
+            self.log_status("👁️ Watching RAW folder for new images...")
+            self.set_progress_text("👁️ Waiting for images...")
+            summary = watch_inbox("RAW", "Done", "Archive", job, stop_event,
+                                  on_result=on_result, log=self.log_status)
+            self.log_status(f"📊 Watch stopped: {summary.processed} processed, {summary.failed} failed")
+            self.log_pipeline_report(summary.pipeline)
+            self.log_stage_report(summary, job)
+            self.log_encoding_report(job.encoder, summary.encoding)
+            self.set_progress_text(f"✅ Watch stopped: {summary.processed} images processed")
+
+        except Exception as e:
+            self.log_status(f"❌ Critical error while watching: {str(e)}")
+            self.set_progress_text("❌ Watch failed")
+        finally:
+            self.call_in_ui(self.finish_watch)
+
+    def finish_watch(self):
+        """Restore the action buttons once watch mode has stopped (runs on the Tk thread)"""
+        self.watch_stop = None
+        self.watch_btn.configure(state='normal', text="👁️ Watch RAW Folder", bg='#3b82f6')
+        if not self.batch_running:
+            self.process_btn.configure(state='normal', text="🎯 Process Images", bg='#10b981')
+
+    def build_job(self):
+        """Snapshot the Tk variables into a WatermarkJob for the engine"""
+        return WatermarkJob(
+            watermark_path=self.watermark_path.get() or str(self.assets_dir / "watermark.png"),
+            header_path=self.header_path.get() or str(self.assets_dir / "header.png"),
+            footer_path=self.footer_path.get() or str(self.assets_dir / "footer.png"),
+            opacity=self.opacity.get(),
+            footer_margin=self.footer_margin.get(),
+            footer_bottom_margin=self.footer_bottom_margin.get(),
+            header_top_margin=self.header_top_margin.get(),
+            add_text=self.add_text.get(),
+            custom_text=self.custom_text.get(),
+            font_size=self.font_size.get(),
+            text_bold=self.text_bold.get(),
+            text_italic=self.text_italic.get(),
+            text_shadow=self.text_shadow.get(),
+            text_background=self.text_background.get(),
+            text_position=self.text_position.get(),
+            text_outline=self.text_outline.get(),
+            text_color=self.text_color.get(),
+            text_bg_color=self.text_bg_color.get(),
+            text_outline_color=self.text_outline_color.get(),
+            workers=max(1, self.workers.get()),
+            profiles=[OutputProfile.parse(spec.strip()) for spec in self.renditions.get().split(',') if spec.strip()],
+            encoder=self.encoder.get(),
+            recursive=self.include_subfolders.get(),
+            profiling=PROFILED_IMAGES if self.profile_run.get() else 0
+        )
 
     def load_existing_assets(self):
         """Load existing assets from the assets directory"""
@@ -1065,6 +1280,7 @@ class ModernWatermarkApp:
             self.log_status("⚠️ Please setup directories before processing")
 
         self.root.mainloop()
+        self.log_file.close()
 
 
 def main():
@@ -0,0 +1,110 @@
+"""On-disk record of every file a batch has handled, so interrupted runs can resume.
+
+One connection is shared by the pipeline's reader, writer and archiver threads
+behind a lock; the WAL journal keeps other processes reading the same manifest
+while it is written. The status of a file is looked up by primary key.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from overlays import asset_fingerprint
+
+
+RENDERED = "rendered"   # outputs written, original not archived yet
+DONE = "done"           # outputs written and original archived
+
+# Settings that do not change a single output pixel or byte
+_NON_RENDER_SETTINGS = {'workers', 'memory_budget_mb', 'archive_threads', 'recursive', 'shard', 'distributed',
+                        'node_name', 'claim_timeout', 'profiling', 'profiling_dir',
+                        'watermark_path', 'header_path', 'footer_path'}
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """Content hash of a file on disk"""
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as source:
+        for chunk in iter(lambda: source.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def bytes_hash(data):
+    """Content hash of a file already read into memory; matches file_hash"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def settings_hash(job, overlays):
+    """Hash of everything that shapes the output: render settings plus asset contents"""
+    settings = {key: value for key, value in job.to_dict().items() if key not in _NON_RENDER_SETTINGS}
+    settings['assets'] = [asset_fingerprint(asset) if asset else None for asset in overlays]
+    encoded = json.dumps(settings, sort_keys=True, default=str).encode()
+    return hashlib.blake2b(encoded, digest_size=16).hexdigest()
+
+
+class JobManifest:
+    """Per-file status, input hash, settings hash and output paths, keyed by source path"""
+
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.connection = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS files (
+                source TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                input_hash TEXT NOT NULL,
+                settings_hash TEXT NOT NULL,
+                outputs TEXT NOT NULL,
+                updated REAL NOT NULL
+            )""")
+
+    @staticmethod
+    def key(path):
+        return os.path.abspath(path)
+
+    def get(self, path):
+        """Return (status, input_hash, settings_hash, outputs) for a source file, or None"""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT status, input_hash, settings_hash, outputs FROM files WHERE source = ?",
+                (self.key(path),)).fetchone()
+        if row is None:
+            return None
+        status, input_hash, settings, outputs = row
+        return status, input_hash, settings, json.loads(outputs)
+
+    def mark(self, path, status, input_hash, settings, outputs):
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files (source, status, input_hash, settings_hash, outputs, updated) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (self.key(path), status, input_hash, settings, json.dumps(list(outputs)), time.time()))
+
+    def set_status(self, path, status):
+        with self._lock:
+            self.connection.execute("UPDATE files SET status = ?, updated = ? WHERE source = ?",
+                                    (status, time.time(), self.key(path)))
+
+    def is_complete(self, path, input_hash, settings, destinations):
+        """True when this exact content was already rendered with these settings to exactly these
+        destination paths, and those outputs still exist"""
+        record = self.get(path)
+        if record is None:
+            return False
+        status, previous_input, previous_settings, outputs = record
+        # A rerun into another output folder (or with other profiles) must still write its own outputs
+        return (status in (RENDERED, DONE)
+                and previous_input == input_hash
+                and previous_settings == settings
+                and {os.path.abspath(output) for output in outputs}
+                == {os.path.abspath(destination) for destination in destinations}
+                and all(os.path.exists(output) for output in outputs))
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,159 @@
+"""Per-image stage timings, aggregated into histograms for run reports.
+
+Workers time decode, resize, overlay preparation, text, composite and encode
+for each image with a StageTimer; the pipeline's threads add read, write and
+archive. RunMetrics folds every image's timings into one fixed-bucket histogram
+per stage, so a night of images costs a few hundred counters rather than a list
+of samples, and exports them as JSON or in the Prometheus text format (suitable
+for node_exporter's textfile collector).
+"""
+import json
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from atomicfs import write_atomic
+
+
+# Stages in the order an image passes through them
+STAGES = ("read", "decode", "resize", "overlay_prep", "text", "composite", "encode", "write", "archive")
+
+# Histogram bucket upper bounds in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+
+
+class StageTimer:
+    """Seconds one image spent in each stage"""
+
+    def __init__(self):
+        self.seconds = {}
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    @contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - started)
+
+    def iterate(self, iterable, stage):
+        """Yield from iterable, charging the time spent producing each item to stage"""
+        iterator = iter(iterable)
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add(stage, time.perf_counter() - started)
+                return
+            self.add(stage, time.perf_counter() - started)
+            yield item
+
+
+class Histogram:
+    """Counts of observations per bucket, plus count, sum and max"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # One more slot for observations above the last bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate of the q quantile, interpolated linearly inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+    def cumulative(self):
+        """(upper bound, observations at or below it) per bucket, ending with +Inf"""
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield bound, total
+
+    def report(self):
+        return {
+            'count': self.count,
+            'seconds': round(self.sum, 3),
+            'mean_ms': round(self.sum / self.count * 1000, 2) if self.count else 0.0,
+            'p50_ms': round(self.quantile(0.5) * 1000, 2),
+            'p90_ms': round(self.quantile(0.9) * 1000, 2),
+            'p99_ms': round(self.quantile(0.99) * 1000, 2),
+            'max_ms': round(self.max * 1000, 2),
+            'buckets': {('+Inf' if bound == float('inf') else str(bound)): total
+                        for bound, total in self.cumulative()},
+        }
+
+
+class RunMetrics:
+    """One Histogram per stage across every image of a run"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def observe(self, timings):
+        """Add one image's {stage: seconds}"""
+        for stage, seconds in timings.items():
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def ordered(self):
+        """(stage, Histogram) in pipeline order, unknown stages last"""
+        rank = {stage: index for index, stage in enumerate(STAGES)}
+        return sorted(self.stages.items(), key=lambda item: (rank.get(item[0], len(STAGES)), item[0]))
+
+    def report(self):
+        return {stage: histogram.report() for stage, histogram in self.ordered()}
+
+
+def prometheus_text(metrics, counts, prefix="watermark"):
+    """Prometheus text exposition of the stage histograms and the run's {outcome: images} counts.
+
+    The file describes one run and is rewritten by the next, so the counts are
+    gauges (one series per outcome label), not counters.
+    """
+    lines = [f"# HELP {prefix}_stage_seconds Seconds one image spent in a processing stage",
+             f"# TYPE {prefix}_stage_seconds histogram"]
+    for stage, histogram in metrics.ordered():
+        for bound, total in histogram.cumulative():
+            le = "+Inf" if bound == float('inf') else repr(bound)
+            lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {total}')
+        lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+        lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+    lines.append(f"# HELP {prefix}_run_images Images of the last run, by outcome")
+    lines.append(f"# TYPE {prefix}_run_images gauge")
+    for outcome, value in counts.items():
+        lines.append(f'{prefix}_run_images{{outcome="{outcome}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+
+def write_json(path, report):
+    """Write a run report as indented JSON, atomically"""
+    write_atomic(path, json.dumps(report, indent=2, default=str).encode('utf-8'))
+
+
+def write_prometheus(path, metrics, counts):
+    """Write a Prometheus text file atomically, as the textfile collector requires"""
+    write_atomic(path, prometheus_text(metrics, counts).encode('utf-8'))
@@ -0,0 +1,108 @@
+"""Content-addressed store of finished outputs, so unchanged re-deliveries are copied, not re-rendered.
+
+An entry is a directory named after a hash of (input content, settings, output
+format) holding one file per output profile. Entries are touched when served and
+the least recently used ones are evicted once the store exceeds its size budget:
+at the end of every run, and during a run (e.g. a long --watch session) whenever
+a tenth of the budget has been stored since the last eviction.
+"""
+import os
+import shutil
+import hashlib
+import tempfile
+import threading
+
+from atomicfs import copy_atomic
+
+
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+# Bytes stored between evictions during a run, as a fraction of max_bytes
+EVICT_EVERY = 0.1
+
+
+def cache_key(input_hash, settings_digest, output_format):
+    return hashlib.blake2b(f"{input_hash}:{settings_digest}:{output_format}".encode(),
+                           digest_size=20).hexdigest()
+
+
+class OutputCache:
+    """Directory-backed LRU keyed by cache_key(); safe to share between worker processes"""
+
+    def __init__(self, root, max_bytes=DEFAULT_MAX_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._stored = 0
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def fetch(self, key, destinations):
+        """Copy a cached entry to destinations ({profile name: path}); False on a miss"""
+        entry = self._entry(key)
+        if not all(os.path.exists(os.path.join(entry, name)) for name in destinations):
+            return False
+
+        try:
+            for name, destination in destinations.items():
+                copy_atomic(os.path.join(entry, name), destination)
+            # Mark as recently used for eviction
+            os.utime(entry)
+        except FileNotFoundError:
+            # Evicted while being copied
+            return False
+        return True
+
+    def store(self, key, sources):
+        """Add freshly written outputs ({profile name: path}) under key"""
+        entry = self._entry(key)
+        if os.path.exists(entry):
+            return
+
+        os.makedirs(os.path.dirname(entry), exist_ok=True)
+        staging = tempfile.mkdtemp(prefix=".tmp-", dir=os.path.dirname(entry))
+        try:
+            size = 0
+            for name, source in sources.items():
+                shutil.copyfile(source, os.path.join(staging, name))
+                size += os.path.getsize(source)
+            # Publish atomically; another worker may have stored the same content meanwhile
+            os.rename(staging, entry)
+        except OSError:
+            shutil.rmtree(staging, ignore_errors=True)
+            return
+
+        with self._lock:
+            self._stored += size
+            if self._stored < self.max_bytes * EVICT_EVERY:
+                return
+            self._stored = 0
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the store fits max_bytes; returns bytes freed"""
+        entries = []
+        total = 0
+        for shard in os.scandir(self.root):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.startswith(".tmp-"):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in os.scandir(entry.path))
+                    entries.append((entry.stat().st_mtime, size, entry.path))
+                except FileNotFoundError:
+                    # Evicted meanwhile by another run sharing the store
+                    continue
+                total += size
+
+        freed = 0
+        for _, size, path in sorted(entries):
+            if total - freed <= self.max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            freed += size
+        return freed
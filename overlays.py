@@ -0,0 +1,147 @@
+"""Cache of header, footer and watermark overlays pre-scaled to a target width, and of rendered text sprites.
+
+Scaled overlays can be kept premultiplied ("RGBa"): Pillow pastes those onto RGB
+bases as src + dst * (1 - alpha), and opacity becomes one lookup table applied
+uniformly to all four bands. Overlays that overlap on the image can be flattened
+into one layer, so each region of the image is blended once.
+"""
+from PIL import Image, ImageChops
+import hashlib
+from collections import OrderedDict
+
+# Cap on the pixels an OverlayCache keeps, counted at Pillow's four bytes per pixel
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+
+def asset_fingerprint(image):
+    """Content hash of an overlay asset, memoized in image.info so it survives pickling"""
+    fingerprint = image.info.get('fingerprint')
+    if fingerprint is None:
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{image.mode}{image.size}".encode())
+        digest.update(image.tobytes())
+        fingerprint = digest.hexdigest()
+        image.info['fingerprint'] = fingerprint
+    return fingerprint
+
+
+def opacity_table(opacity, premultiplied=False):
+    """point() table scaling alpha by opacity; premultiplied color bands scale along with it"""
+    scaled = [round(value * opacity) for value in range(256)]
+    return (scaled if premultiplied else list(range(256))) * 3 + scaled
+
+
+def clamp_premultiplied(image):
+    """Cap each color band of an RGBa image at its alpha.
+
+    Resampling (LANCZOS rings) can leave a premultiplied color above its alpha;
+    Pillow's paste would then overflow and wrap that pixel to a dark speck.
+    """
+    *colors, alpha = image.split()
+    return Image.merge("RGBa", [ImageChops.darker(band, alpha) for band in colors] + [alpha])
+
+
+def entry_bytes(entry):
+    """Approximate memory held by a cache entry: its images at four bytes per pixel plus any arrays"""
+    if isinstance(entry, Image.Image):
+        return entry.width * entry.height * 4
+    if isinstance(entry, (tuple, list)):
+        return sum(entry_bytes(item) for item in entry)
+    return getattr(entry, 'nbytes', 0)
+
+
+def flatten_overlays(placements):
+    """Merge (overlay, position) pairs whose boxes overlap into one layer per overlapping group.
+
+    Groups are composited in paint order with alpha_composite and converted back
+    to premultiplied RGBa if any member was; overlays that overlap nothing are
+    returned as they are. Pasting the result matches pasting the originals in
+    order to within rounding.
+    """
+    groups = []    # [left, top, right, bottom, [indices]]
+    for index, (overlay, (x, y)) in enumerate(placements):
+        box = [x, y, x + overlay.width, y + overlay.height, [index]]
+        for group in [g for g in groups if g[0] < box[2] and box[0] < g[2] and g[1] < box[3] and box[1] < g[3]]:
+            groups.remove(group)
+            box = [min(box[0], group[0]), min(box[1], group[1]), max(box[2], group[2]), max(box[3], group[3]),
+                   group[4] + box[4]]
+        groups.append(box)
+
+    flattened = []
+    for left, top, right, bottom, indices in sorted(groups, key=lambda group: min(group[4])):
+        if len(indices) == 1:
+            flattened.append(placements[indices[0]])
+            continue
+        layer = Image.new("RGBA", (right - left, bottom - top), (0, 0, 0, 0))
+        premultiplied = False
+        for overlay, (x, y) in (placements[index] for index in sorted(indices)):
+            if overlay.mode == "RGBa":
+                overlay = overlay.convert("RGBA")
+                premultiplied = True
+            layer.alpha_composite(overlay, (x - left, y - top))
+        flattened.append((layer.convert("RGBa") if premultiplied else layer, (left, top)))
+    return flattened
+
+
+class OverlayCache:
+    """LRU of scaled overlays keyed by (asset fingerprint, width, margins, resample, opacity, premultiplied).
+
+    Also holds text sprites and flattened overlay layers. Bounded both by entry
+    count and by max_bytes of pixels, whichever is reached first; the newest entry
+    is always kept.
+    """
+
+    def __init__(self, max_entries=32, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.sizes = {}
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def cached(self, key, factory):
+        """Return the entry for key, building it with factory() on a miss"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = factory()
+
+        self.entries[key] = entry
+        self.sizes[key] = entry_bytes(entry)
+        self.bytes += self.sizes[key]
+        while len(self.entries) > 1 and (len(self.entries) > self.max_entries or self.bytes > self.max_bytes):
+            evicted, _ = self.entries.popitem(last=False)
+            self.bytes -= self.sizes.pop(evicted)
+        return entry
+
+    def scaled(self, asset, width, margins=(), resample=Image.Resampling.LANCZOS, opacity=1.0, premultiplied=False):
+        """Return asset resized to width (keeping aspect ratio) with opacity applied, reusing earlier results"""
+        key = (asset_fingerprint(asset), width, tuple(margins), resample, opacity, premultiplied)
+
+        def build():
+            overlay = asset.convert("RGBa") if premultiplied else asset
+            if width != asset.width:
+                height = int(asset.height * (width / asset.width))
+                overlay = overlay.resize((width, height), resample)
+                if premultiplied:
+                    overlay = clamp_premultiplied(overlay)
+            # Opacity goes on after resizing, so only the scaled pixels pass through the table
+            if opacity != 1.0:
+                overlay = overlay.point(opacity_table(opacity, premultiplied))
+            return overlay
+
+        return self.cached(key, build)
+
+    def flattened(self, placements):
+        """flatten_overlays(placements), built once per distinct set of overlay objects and positions"""
+        # The entry keeps the overlays alive, so their ids in the key cannot be reused while it is cached
+        key = ('flattened',) + tuple((id(overlay), position) for overlay, position in placements)
+        return self.cached(key, lambda: (placements, flatten_overlays(placements)))[1]
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.entries), 'bytes': self.bytes}
@@ -0,0 +1,421 @@
+"""Staged batch pipeline that keeps disk and CPU busy at the same time.
+
+    reader threads ──> compositor pool ──> writer threads ──> archiver threads
+      (prefetch,          (decode,            (commit outputs,   (move originals,
+       hash, skip)         composite, encode)  fill caches)       finish manifest)
+
+Stages are connected by bounded queues, so a slow stage applies backpressure to
+the ones feeding it instead of letting prefetched images pile up in memory. Files
+the manifest or output cache already cover go straight from the readers to the
+archiver. Each image is planned from its header first (output format, frames,
+estimated peak memory); images planned as tiled are not prefetched but streamed
+from disk by the worker, which leaves finished outputs for the writers to move
+into place. The dispatcher admits images to the compositor pool against a memory
+budget, using each plan's estimate; an image larger than the whole budget runs
+alone. Outputs are committed atomically (temporary file, fsync, rename), so a
+crash never leaves a truncated file in the output folder, and originals are moved
+by their own pool of archiver threads: a rename on the same filesystem, an atomic
+copy and delete across filesystems. Queue depths, per-stage busy time and memory
+admission are collected for the run report, and each image's read, write and
+archive seconds join the worker's stage timings on its result.
+"""
+import os
+import time
+import queue
+import threading
+from concurrent.futures import wait, FIRST_COMPLETED, BrokenExecutor
+
+from atomicfs import write_atomic, move_file
+from manifest import bytes_hash, file_hash, RENDERED, DONE
+from outputcache import cache_key
+
+
+_STOP = object()
+
+
+class MeteredQueue(queue.Queue):
+    """Bounded queue that samples its depth on every put of a work item"""
+
+    def __init__(self, name, maxsize):
+        super().__init__(maxsize)
+        self.name = name
+        self.peak = 0
+        self.depth_total = 0
+        self.samples = 0
+
+    def put(self, item, block=True, timeout=None):
+        super().put(item, block, timeout)
+        if item is _STOP:
+            return
+        depth = self.qsize()
+        self.peak = max(self.peak, depth)
+        self.depth_total += depth
+        self.samples += 1
+
+    def report(self):
+        return {'capacity': self.maxsize, 'peak': self.peak,
+                'mean': round(self.depth_total / self.samples, 2) if self.samples else 0.0}
+
+
+class StageStats:
+    """Items handled and seconds spent busy by the threads (or processes) of one stage"""
+
+    def __init__(self, name, concurrency):
+        self.name = name
+        self.concurrency = concurrency
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self.items += 1
+            self.busy += seconds
+
+    def report(self, wall):
+        capacity = wall * self.concurrency
+        return {'items': self.items, 'busy_seconds': round(self.busy, 3),
+                'utilization': round(self.busy / capacity, 3) if capacity else 0.0}
+
+
+class _Work:
+    """One image travelling through the stages"""
+
+    def __init__(self, image_file, result):
+        self.image_file = image_file
+        self.result = result
+        self.data = None
+        self.input_hash = None
+        self.plan = None
+        self.destinations = {}
+        self.outputs = {}
+
+
+class Pipeline:
+    """Run submitted image names through read -> composite -> write -> archive"""
+
+    def __init__(self, executor, workers, render_task, plan, destinations, new_result,
+                 src, archive, settings_digest, manifest=None, output_cache=None,
+                 readers=4, writers=2, archivers=2, depth=None, memory_budget=None, manifest_root=None):
+        self.executor = executor
+        self.workers = workers
+        self.render_task = render_task
+        self.plan = plan
+        self.destinations = destinations
+        self.new_result = new_result
+        self.src = src
+        self.archive = archive
+        self.settings_digest = settings_digest
+        self.manifest = manifest
+        # Manifest entries are keyed under the inbox even when images are read from elsewhere (a claim folder)
+        self.manifest_root = manifest_root or src
+        self.output_cache = output_cache
+        self.readers = readers
+        self.writers = writers
+        self.archivers = archivers
+        self.memory_budget = memory_budget
+
+        # Memory admission, for the report
+        self.peak_reserved = 0
+        self.deferred = 0
+        # Originals moved by rename and by copy across filesystems
+        self.archived = {'renamed': 0, 'copied': 0}
+
+        depth = depth or 2 * workers
+        self.read_queue = MeteredQueue("read", depth)
+        self.compute_queue = MeteredQueue("composite", depth)
+        self.write_queue = MeteredQueue("write", depth)
+        self.archive_queue = MeteredQueue("archive", depth)
+        self.result_queue = queue.Queue()
+
+        self.stages = {
+            'read': StageStats('read', readers),
+            'composite': StageStats('composite', workers),
+            'write': StageStats('write', writers),
+            'archive': StageStats('archive', archivers),
+        }
+        self.submitted = 0
+        self.completed = 0
+        self._readers_left = readers
+        self._writers_left = writers
+        self._archivers_left = archivers
+        self._count_lock = threading.Lock()
+        self._threads = []
+        self._started = None
+
+    # Public API
+
+    def start(self):
+        self._started = time.perf_counter()
+        targets = ([self._read_loop] * self.readers + [self._dispatch_loop]
+                   + [self._write_loop] * self.writers + [self._archive_loop] * self.archivers)
+        for target in targets:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def submit(self, image_file, timeout=None):
+        """Queue an image name; blocks (or raises queue.Full after timeout) while readers are saturated"""
+        self.read_queue.put(image_file, timeout=timeout)
+        with self._count_lock:
+            self.submitted += 1
+
+    def close(self):
+        """No more submissions; the stages drain and results() ends"""
+        for _ in range(self.readers):
+            self.read_queue.put(_STOP)
+
+    @property
+    def pending(self):
+        return self.submitted - self.completed
+
+    def results(self):
+        """Yield each finished TaskResult, in completion order, until the pipeline drains"""
+        while True:
+            result = self.result_queue.get()
+            if result is _STOP:
+                break
+            self.completed += 1
+            yield result
+        for thread in self._threads:
+            thread.join()
+
+    def report(self):
+        wall = time.perf_counter() - self._started if self._started else 0.0
+        queues = (self.read_queue, self.compute_queue, self.write_queue, self.archive_queue)
+        return {
+            'wall_seconds': round(wall, 3),
+            'queues': {q.name: q.report() for q in queues},
+            'stages': {name: stats.report(wall) for name, stats in self.stages.items()},
+            'memory': {'budget': self.memory_budget, 'peak_reserved': self.peak_reserved,
+                       'deferred': self.deferred},
+            'archived': dict(self.archived),
+        }
+
+    # Stages
+
+    def _fail(self, work, error):
+        work.result.error = str(error)
+        self.result_queue.put(work.result)
+
+    def _read_loop(self):
+        while True:
+            image_file = self.read_queue.get()
+            if image_file is _STOP:
+                break
+
+            work = _Work(image_file, self.new_result(image_file))
+            started = time.perf_counter()
+            try:
+                raw_image_path = os.path.join(self.src, image_file)
+                work.plan = self.plan(raw_image_path)
+                if work.plan.tiled:
+                    # Too large to prefetch; the worker streams it from disk
+                    work.input_hash = file_hash(raw_image_path)
+                else:
+                    with open(raw_image_path, 'rb') as source:
+                        work.data = source.read()
+                    work.input_hash = bytes_hash(work.data)
+                work.destinations = self.destinations(image_file, work.plan)
+                output_key = cache_key(work.input_hash, self.settings_digest, work.plan.cache_format())
+
+                if self.manifest and self.manifest.is_complete(self._manifest_key(image_file), work.input_hash,
+                                                               self.settings_digest, work.destinations.values()):
+                    # Same content and settings were rendered before (e.g. a run that died before archiving)
+                    work.result.skipped = True
+                elif self.output_cache and self.output_cache.fetch(output_key, work.destinations):
+                    # Same content and settings were rendered before under any name or folder
+                    work.result.reused = True
+                    self._mark_rendered(work)
+            except Exception as e:
+                self.stages['read'].add(time.perf_counter() - started)
+                self._fail(work, e)
+                continue
+
+            work.result.timings['read'] = time.perf_counter() - started
+            self.stages['read'].add(work.result.timings['read'])
+            if work.result.skipped or work.result.reused:
+                work.data = None
+                self.archive_queue.put(work)
+            else:
+                self.compute_queue.put(work)
+
+        with self._count_lock:
+            self._readers_left -= 1
+            last = self._readers_left == 0
+        if last:
+            self.compute_queue.put(_STOP)
+
+    def _admits(self, work, reserved, in_flight):
+        """Whether work fits the memory budget next to what is in flight; anything fits an idle pool"""
+        return not in_flight or self.memory_budget is None or reserved + work.plan.memory <= self.memory_budget
+
+    def _dispatch_loop(self):
+        in_flight = {}
+        reserved = 0
+        held = None    # next image, waiting for memory to be released
+        held_deferred = False
+        closing = False
+        try:
+            while not closing or in_flight or held:
+                # Keep every worker busy with at most one task waiting behind it, within the memory budget
+                while len(in_flight) < 2 * self.workers:
+                    if held is None:
+                        if closing:
+                            break
+                        try:
+                            held = self.compute_queue.get(timeout=0 if in_flight else None)
+                        except queue.Empty:
+                            break
+                        if held is _STOP:
+                            held = None
+                            closing = True
+                            break
+                    if not self._admits(held, reserved, in_flight):
+                        if not held_deferred:
+                            self.deferred += 1
+                            held_deferred = True
+                        break
+
+                    work, held, held_deferred = held, None, False
+                    reserved += work.plan.memory
+                    self.peak_reserved = max(self.peak_reserved, reserved)
+                    source, work.data = work.data, None
+                    if source is None:
+                        source = os.path.join(self.src, work.image_file)
+                    try:
+                        future = self.executor.submit(self.render_task, work.image_file, source, work.plan,
+                                                      work.destinations)
+                    except Exception as e:
+                        # BrokenProcessPool, or the pool was shut down under us (Ctrl+C)
+                        self._fail(work, e)
+                        raise
+                    in_flight[future] = work
+
+                if not in_flight:
+                    continue
+
+                finished, _ = wait(list(in_flight), timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    work = in_flight.pop(future)
+                    reserved -= work.plan.memory
+                    try:
+                        rendered = future.result()
+                    except BrokenExecutor as e:
+                        self._fail(work, e)
+                        raise
+                    except Exception as e:
+                        self._fail(work, e)
+                        continue
+
+                    self.stages['composite'].add(rendered.render_seconds)
+                    work.result.timings.update(rendered.timings)
+                    work.result.worker = rendered.worker
+                    work.result.cache_hits = rendered.cache_hits
+                    work.result.cache_misses = rendered.cache_misses
+                    if rendered.error is not None:
+                        self._fail(work, rendered.error)
+                        continue
+                    work.outputs = rendered.outputs
+                    work.result.encode_seconds = rendered.encode_seconds
+                    work.result.output_bytes = {
+                        name: os.path.getsize(encoded) if isinstance(encoded, str) else len(encoded)
+                        for name, encoded in rendered.outputs.items()}
+                    self.write_queue.put(work)
+
+        except Exception as e:
+            # A worker died (e.g. killed by the OOM killer) and took the pool with it, or the pool
+            # was shut down: no image can be rendered any more, so fail everything still owned here
+            for work in list(in_flight.values()) + ([held] if held is not None else []):
+                self._fail(work, e)
+            if not closing:
+                self._fail_queued(e)
+        finally:
+            # Always let the writers (and after them the archivers and results()) drain
+            for _ in range(self.writers):
+                self.write_queue.put(_STOP)
+
+    def _fail_queued(self, error):
+        """Fail every image still arriving from the readers, until they stop"""
+        while True:
+            work = self.compute_queue.get()
+            if work is _STOP:
+                return
+            self._fail(work, error)
+
+    def _write_loop(self):
+        while True:
+            work = self.write_queue.get()
+            if work is _STOP:
+                break
+
+            started = time.perf_counter()
+            try:
+                for name, encoded in work.outputs.items():
+                    if isinstance(encoded, str):
+                        # Streamed to a temporary file next to the destination by the worker
+                        os.replace(encoded, work.destinations[name])
+                    else:
+                        write_atomic(work.destinations[name], encoded)
+                work.outputs = {}
+
+                if self.output_cache:
+                    output_key = cache_key(work.input_hash, self.settings_digest, work.plan.cache_format())
+                    self.output_cache.store(output_key, work.destinations)
+                self._mark_rendered(work)
+            except Exception as e:
+                self.stages['write'].add(time.perf_counter() - started)
+                self._fail(work, e)
+                continue
+
+            work.result.timings['write'] = time.perf_counter() - started
+            self.stages['write'].add(work.result.timings['write'])
+            self.archive_queue.put(work)
+
+        with self._count_lock:
+            self._writers_left -= 1
+            last = self._writers_left == 0
+        if last:
+            for _ in range(self.archivers):
+                self.archive_queue.put(_STOP)
+
+    def _archive_loop(self):
+        while True:
+            work = self.archive_queue.get()
+            if work is _STOP:
+                break
+
+            started = time.perf_counter()
+            try:
+                raw_image_path = os.path.join(self.src, work.image_file)
+                archived_path = os.path.join(self.archive, work.image_file)
+                if os.path.dirname(work.image_file):
+                    os.makedirs(os.path.dirname(archived_path), exist_ok=True)
+                how = move_file(raw_image_path, archived_path)
+                with self._count_lock:
+                    self.archived[how] += 1
+                if self.manifest:
+                    self.manifest.set_status(self._manifest_key(work.image_file), DONE)
+            except Exception as e:
+                work.result.error = str(e)
+
+            work.result.timings['archive'] = time.perf_counter() - started
+            self.stages['archive'].add(work.result.timings['archive'])
+            self.result_queue.put(work.result)
+
+        with self._count_lock:
+            self._archivers_left -= 1
+            last = self._archivers_left == 0
+        if last:
+            self.result_queue.put(_STOP)
+
+    # Helpers
+
+    def _manifest_key(self, image_file):
+        return os.path.join(self.manifest_root, image_file)
+
+    def _mark_rendered(self, work):
+        if self.manifest:
+            self.manifest.mark(self._manifest_key(work.image_file), RENDERED,
+                               work.input_hash, self.settings_digest, work.destinations.values())
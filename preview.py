@@ -0,0 +1,94 @@
+"""Live preview of the full overlay pipeline on a downscaled proxy of a sample image.
+
+The sample is decoded once into a small proxy (JPEGs straight at reduced scale
+through draft mode) and the assets once per file version, so dragging a slider
+only re-runs the compositing on a few hundred thousand pixels. Overlays are
+scaled exactly as for a rendition of that size, so the preview matches the
+batch output. Requests are rendered on a background thread; when several
+arrive while one is rendering, only the latest is drawn.
+"""
+from PIL import Image
+import os
+import time
+import threading
+
+from overlays import OverlayCache
+from engine import load_asset, native_base, apply_overlays, scaled_job
+
+
+class PreviewRenderer:
+    """Render (sample image, WatermarkJob) pairs at proxy size, latest request wins"""
+
+    def __init__(self, max_edge=480):
+        self.max_edge = max_edge
+        # Text sprites and faded overlays change with every slider step; keep a few around
+        self.overlay_cache = OverlayCache(max_entries=32)
+        self._proxy = None    # (key, proxy image, scale)
+        self._assets = {}     # asset path -> (key, image)
+        self._request = None
+        self._wakeup = threading.Condition()
+        self._thread = None
+
+    @staticmethod
+    def _file_key(path):
+        stat = os.stat(path)
+        return path, stat.st_size, stat.st_mtime_ns
+
+    def proxy(self, sample_path):
+        """Return (proxy image, scale relative to the original), decoding only when the file changed"""
+        key = self._file_key(sample_path)
+        if self._proxy is None or self._proxy[0] != key:
+            source = Image.open(sample_path)
+            full_width = source.width
+            if source.format == "JPEG":
+                source.draft(source.mode, (self.max_edge, self.max_edge))
+            proxy = native_base(source)
+            proxy.thumbnail((self.max_edge, self.max_edge), Image.Resampling.LANCZOS)
+            self._proxy = (key, proxy, proxy.width / full_width)
+        return self._proxy[1], self._proxy[2]
+
+    def asset(self, path):
+        """Load an overlay asset, reusing the previous load while the file is unchanged"""
+        if not path or not os.path.exists(path):
+            return None
+        key = self._file_key(path)
+        cached = self._assets.get(path)
+        if cached is None or cached[0] != key:
+            cached = (key, load_asset(path))
+            self._assets[path] = cached
+        return cached[1]
+
+    def render(self, sample_path, job):
+        """Composite job onto the sample's proxy; returns (image, seconds)"""
+        started = time.perf_counter()
+        proxy, scale = self.proxy(sample_path)
+        watermark = self.asset(job.watermark_path)
+        header = self.asset(job.header_path)
+        footer = self.asset(job.footer_path)
+        image = apply_overlays(proxy.copy(), watermark, header, footer,
+                               scaled_job(job, scale), self.overlay_cache, scale)
+        return image, time.perf_counter() - started
+
+    def request(self, sample_path, job, on_done):
+        """Render in the background and call on_done(image, seconds, error) from that thread"""
+        with self._wakeup:
+            self._request = (sample_path, job, on_done)
+            self._wakeup.notify()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._render_loop, daemon=True)
+                self._thread.start()
+
+    def _render_loop(self):
+        while True:
+            with self._wakeup:
+                while self._request is None:
+                    self._wakeup.wait()
+                sample_path, job, on_done = self._request
+                self._request = None
+
+            try:
+                image, seconds = self.render(sample_path, job)
+            except Exception as e:
+                on_done(None, 0.0, e)
+                continue
+            on_done(image, seconds, None)
@@ -0,0 +1,112 @@
+"""Opt-in cProfile and tracemalloc capture of the first images a run renders.
+
+The worker pool shares one counter, so exactly the first N images rendered
+(across all workers) are profiled, wherever they run. For each one the worker
+writes a pstats file, the same statistics as text sorted by cumulative time,
+and the top allocation sites with the traced peak. When the run ends the
+pstats files are merged into one combined profile. Images after the first N
+run without profiling overhead.
+"""
+import io
+import os
+import time
+import pstats
+import cProfile
+import tracemalloc
+from contextlib import contextmanager
+
+
+# Frames kept per allocation, and how many functions and allocation sites the text reports list
+TRACE_FRAMES = 10
+TOP_ENTRIES = 40
+
+COMBINED = "combined.pstats"
+
+
+def run_folder(root):
+    """A new timestamped folder under root for one run's profiles"""
+    folder = os.path.join(root, time.strftime("%Y%m%d-%H%M%S"))
+    suffix = 1
+    while os.path.exists(folder):
+        suffix += 1
+        folder = os.path.join(root, f"{time.strftime('%Y%m%d-%H%M%S')}-{suffix}")
+    os.makedirs(folder)
+    return folder
+
+
+class ImageProfiler:
+    """Profile the first limit images handed to profiled(), counted across processes by counter.
+
+    counter is a multiprocessing.Value('i') shared by every pool worker.
+    """
+
+    def __init__(self, folder, limit, counter):
+        self.folder = folder
+        self.limit = limit
+        self.counter = counter
+
+    def _claim(self):
+        """Index of the next profile slot, or None when limit images were already profiled"""
+        with self.counter.get_lock():
+            if self.counter.value >= self.limit:
+                return None
+            self.counter.value += 1
+            return self.counter.value
+
+    @contextmanager
+    def profiled(self, image_file):
+        """Profile the enclosed rendering of image_file if a slot is left"""
+        index = self._claim()
+        if index is None:
+            yield
+            return
+
+        base = os.path.join(self.folder, f"{index:04d}-{image_file.replace(os.sep, '__').replace('/', '__')}")
+        tracing = not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start(TRACE_FRAMES)
+        tracemalloc.reset_peak()
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if tracing:
+                tracemalloc.stop()
+            self._dump(base, image_file, profile, snapshot, current, peak)
+
+    @staticmethod
+    def _dump(base, image_file, profile, snapshot, current, peak):
+        profile.dump_stats(base + ".pstats")
+
+        text = io.StringIO()
+        stats = pstats.Stats(profile, stream=text)
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_ENTRIES)
+        with open(base + ".cumulative.txt", 'w', encoding='utf-8') as report:
+            report.write(f"{image_file} (pid {os.getpid()})\n")
+            report.write(text.getvalue())
+
+        # Allocations made while rendering and still alive at the end, grouped by line, largest first
+        snapshot = snapshot.filter_traces([tracemalloc.Filter(False, tracemalloc.__file__)])
+        with open(base + ".alloc.txt", 'w', encoding='utf-8') as report:
+            report.write(f"{image_file} (pid {os.getpid()})\n")
+            report.write(f"Traced peak {peak / 1024 ** 2:.1f} MB, {current / 1024 ** 2:.1f} MB still allocated\n\n")
+            for statistic in snapshot.statistics('lineno')[:TOP_ENTRIES]:
+                report.write(f"{statistic}\n")
+
+
+def combine(folder):
+    """Merge every per-image pstats file in folder into COMBINED; returns how many were merged"""
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                   if name.endswith(".pstats") and name != COMBINED)
+    if not paths:
+        return 0
+    stats = pstats.Stats(*paths)
+    stats.dump_stats(os.path.join(folder, COMBINED))
+    with open(os.path.join(folder, "combined.cumulative.txt"), 'w', encoding='utf-8') as report:
+        stats.stream = report
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_ENTRIES)
+    return len(paths)
@@ -0,0 +1,48 @@
+"""Reruns against the job manifest: what is skipped and what is rendered again."""
+import os
+import shutil
+import tempfile
+import unittest
+
+from PIL import Image
+
+from engine import WatermarkJob, watermark_batch
+
+
+class RerunTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.raw = os.path.join(self.root, "RAW")
+        self.archive = os.path.join(self.root, "Archive")
+        self.state = os.path.join(self.root, "state")
+        os.makedirs(self.raw)
+        Image.new("RGB", (64, 48), "gray").save(os.path.join(self.raw, "a.jpg"))
+        self.job = WatermarkJob(workers=1)
+
+    def run_batch(self, dst):
+        # No output cache, so a rerun is either skipped by the manifest or rendered
+        return watermark_batch(self.raw, dst, self.archive, self.job, state_dir=self.state, output_cache_bytes=0)
+
+    def redeliver(self):
+        shutil.copy(os.path.join(self.archive, "a.jpg"), self.raw)
+
+    def test_rerun_into_same_output_is_skipped(self):
+        done = os.path.join(self.root, "Done")
+        self.assertEqual(self.run_batch(done).processed, 1)
+        self.redeliver()
+        summary = self.run_batch(done)
+        self.assertEqual((summary.processed, summary.skipped), (1, 1))
+
+    def test_rerun_into_other_output_is_rendered(self):
+        self.run_batch(os.path.join(self.root, "Done"))
+        self.redeliver()
+        other = os.path.join(self.root, "Other")
+        summary = self.run_batch(other)
+        self.assertEqual((summary.processed, summary.skipped, summary.failed), (1, 0, 0))
+        self.assertTrue(os.path.exists(os.path.join(other, "a.jpg")))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,267 @@
+"""Band-by-band reading and writing of TIFFs too large to decode as one frame.
+
+TiffBands decodes a baseline TIFF's strips or tiles straight from the file and
+hands them out as full-width bands of rows, so a gigapixel scan never exists in
+memory at once. StripTiffWriter appends each composited band as a Deflate strip
+and writes the directory last, and BandReducer shrinks the same stream of bands
+by an integer factor for the smaller renditions without seams between bands.
+"""
+from PIL import Image
+import os
+import zlib
+import struct
+
+# Rows per band when streaming strips; tiled TIFFs use one row of tiles per band
+BAND_ROWS = 256
+
+# Compression tag values TiffBands can decode itself
+NONE, DEFLATE, ADOBE_DEFLATE, PACKBITS = 1, 8, 32946, 32773
+
+_READ_CHUNK = 1024 * 1024
+
+
+def band_layout(image):
+    """(mode, rawmode) when image is an 8-bit TIFF TiffBands can stream, else None"""
+    if image.format != "TIFF":
+        return None
+    tags = image.tag_v2
+    if (tags.get(259) or NONE) not in (NONE, DEFLATE, ADOBE_DEFLATE, PACKBITS):
+        return None
+    # Predictors, planar layouts and reversed bit order would need a per-pixel pass in Python
+    if (tags.get(317) or 1) != 1 or (tags.get(284) or 1) != 1 or (tags.get(266) or 1) != 1:
+        return None
+    if any(bits != 8 for bits in tags.get(258) or (1,)):
+        return None
+    if 273 not in tags and 324 not in tags:
+        return None
+
+    photometric, samples = tags.get(262), tags.get(277) or 1
+    if samples == 1 and photometric in (0, 1):
+        return "L", "L;I" if photometric == 0 else "L"
+    if samples == 3 and photometric == 2:
+        return "RGB", "RGB"
+    if samples == 4 and photometric == 2:
+        # Extra sample 1 is associated (premultiplied) alpha
+        return "RGBA", "RGBa" if tuple(tags.get(338) or ()) == (1,) else "RGBA"
+    return None
+
+
+def band_rows(image):
+    """Rows per band TiffBands will produce for image"""
+    return image.tag_v2[323] if 324 in image.tag_v2 else BAND_ROWS
+
+
+def reduction_factor(size, target):
+    """Largest integer factor size can be reduced by without dropping below target"""
+    return max(1, min(size[0] // target[0], size[1] // target[1]))
+
+
+class TiffBands:
+    """Decode a strip or tile TIFF into full-width bands of rows, reading only what each band needs"""
+
+    def __init__(self, path):
+        with Image.open(path) as image:
+            layout = band_layout(image)
+            if layout is None:
+                raise ValueError(f"{os.path.basename(path)} is not a TIFF layout that can be streamed")
+            tags = image.tag_v2
+            self.path = path
+            self.size = image.size
+            self.mode, self.rawmode = layout
+            self.band_rows = band_rows(image)
+            self.compression = tags.get(259) or NONE
+            self.samples = len(self.mode)
+            if 324 in tags:
+                self.tile_size = (tags[322], tags[323])
+                self.offsets, self.counts = tags[324], tags[325]
+            else:
+                self.tile_size = None
+                self.rows_per_strip = min(image.height, tags.get(278) or image.height)
+                self.offsets, self.counts = tags[273], tags[279]
+
+    def bands(self):
+        """Yield (top row, band image) from top to bottom"""
+        with open(self.path, 'rb') as source:
+            if self.tile_size:
+                yield from self._tile_bands(source)
+            else:
+                yield from self._strip_bands(source)
+
+    def _unpack(self, data, width, rows):
+        """Raw pixel bytes of one compressed strip or tile"""
+        if self.compression in (DEFLATE, ADOBE_DEFLATE):
+            return zlib.decompress(data)
+        if self.compression == PACKBITS:
+            # PackBits runs are byte-oriented, so decode the samples as one wide grayscale image
+            return Image.frombytes("L", (width * self.samples, rows), data, "packbits", "L").tobytes()
+        return data
+
+    def _strip_data(self, source):
+        """Stream the pixel bytes of every strip, decompressing large ones incrementally"""
+        width, height = self.size
+        for index, (offset, count) in enumerate(zip(self.offsets, self.counts)):
+            source.seek(offset)
+            if self.compression == PACKBITS:
+                rows = min(self.rows_per_strip, height - index * self.rows_per_strip)
+                yield self._unpack(source.read(count), width, rows)
+                continue
+
+            inflate = zlib.decompressobj() if self.compression != NONE else None
+            remaining = count
+            while remaining:
+                chunk = source.read(min(_READ_CHUNK, remaining))
+                if not chunk:
+                    raise ValueError(f"{os.path.basename(self.path)} is truncated")
+                remaining -= len(chunk)
+                yield inflate.decompress(chunk) if inflate else chunk
+            if inflate:
+                yield inflate.flush()
+
+    def _strip_bands(self, source):
+        width, height = self.size
+        stride = width * self.samples
+        pending = bytearray()
+        top = 0
+        for data in self._strip_data(source):
+            pending += data
+            while top + self.band_rows < height and len(pending) >= self.band_rows * stride:
+                band_bytes = self.band_rows * stride
+                yield top, Image.frombytes(self.mode, (width, self.band_rows), bytes(pending[:band_bytes]),
+                                           "raw", self.rawmode)
+                del pending[:band_bytes]
+                top += self.band_rows
+
+        rows = height - top
+        if len(pending) < rows * stride:
+            raise ValueError(f"{os.path.basename(self.path)} is truncated")
+        yield top, Image.frombytes(self.mode, (width, rows), bytes(pending[:rows * stride]), "raw", self.rawmode)
+
+    def _tile_bands(self, source):
+        width, height = self.size
+        tile_width, tile_height = self.tile_size
+        across = -(-width // tile_width)
+        for row, top in enumerate(range(0, height, tile_height)):
+            band = Image.new(self.mode, (width, min(tile_height, height - top)))
+            for column in range(across):
+                index = row * across + column
+                source.seek(self.offsets[index])
+                data = self._unpack(source.read(self.counts[index]), tile_width, tile_height)
+                # Edge tiles are padded to the full tile size; paste clips them to the band
+                tile = Image.frombytes(self.mode, (tile_width, tile_height), data, "raw", self.rawmode)
+                band.paste(tile, (column * tile_width, 0))
+            yield top, band
+
+
+class BandReducer:
+    """Shrink a top-to-bottom stream of bands by an integer factor with Image.reduce.
+
+    Rows that do not fill a whole factor-high block are carried over to the next
+    band, so the result matches reducing the whole frame at once.
+    """
+
+    def __init__(self, size, mode, factor):
+        self.factor = factor
+        self.width = size[0]
+        self.image = Image.new(mode, (-(-size[0] // factor), -(-size[1] // factor)))
+        self.top = 0
+        self.carry = None
+
+    def feed(self, band):
+        if self.carry is not None:
+            joined = Image.new(band.mode, (self.width, self.carry.height + band.height))
+            joined.paste(self.carry, (0, 0))
+            joined.paste(band, (0, self.carry.height))
+            band = joined
+
+        whole = band.height - band.height % self.factor
+        if whole:
+            self.image.paste(band.crop((0, 0, self.width, whole)).reduce(self.factor), (0, self.top))
+            self.top += whole // self.factor
+        self.carry = band.crop((0, whole, self.width, band.height)) if whole < band.height else None
+
+    def result(self):
+        """The reduced frame; call once after the last band"""
+        if self.carry is not None:
+            self.image.paste(self.carry.reduce(self.factor), (0, self.top))
+            self.carry = None
+        return self.image
+
+
+class StripTiffWriter:
+    """Write an RGB or RGBA image as a Deflate-compressed strip TIFF, one band at a time.
+
+    Every band but the last must be rows_per_strip rows high. The image file
+    directory goes after the strips, so nothing is buffered beyond one band.
+    """
+
+    _SHORT, _LONG = 3, 4
+
+    def __init__(self, path, size, mode, rows_per_strip, level=6):
+        self.path = path
+        self.size = size
+        self.mode = mode
+        self.rows_per_strip = rows_per_strip
+        self.level = level
+        self.offsets = []
+        self.counts = []
+        self.file = open(path, 'wb')
+        # Little-endian classic TIFF; the directory offset is patched in by close()
+        self.file.write(b"II*\0\0\0\0\0")
+
+    def write(self, band):
+        data = zlib.compress(band.tobytes(), self.level)
+        self.offsets.append(self.file.tell())
+        self.counts.append(len(data))
+        self.file.write(data)
+
+    def close(self):
+        samples = len(self.mode)
+        tags = [
+            (256, self._LONG, [self.size[0]]),
+            (257, self._LONG, [self.size[1]]),
+            (258, self._SHORT, [8] * samples),
+            (259, self._SHORT, [DEFLATE]),
+            (262, self._SHORT, [2]),
+            (273, self._LONG, self.offsets),
+            (277, self._SHORT, [samples]),
+            (278, self._LONG, [self.rows_per_strip]),
+            (279, self._LONG, self.counts),
+            (284, self._SHORT, [1]),
+        ]
+        if self.mode == "RGBA":
+            # Unassociated (straight) alpha
+            tags.append((338, self._SHORT, [2]))
+
+        entries = []
+        for tag, kind, values in tags:
+            payload = struct.pack(f"<{len(values)}{'H' if kind == self._SHORT else 'I'}", *values)
+            if len(payload) > 4:
+                self._align()
+                offset = self.file.tell()
+                self.file.write(payload)
+                payload = struct.pack("<I", offset)
+            entries.append(struct.pack("<HHI", tag, kind, len(values)) + payload.ljust(4, b"\0"))
+
+        self._align()
+        directory = self.file.tell()
+        if directory + 6 + 12 * len(entries) >= 2 ** 32:
+            self.abort()
+            raise ValueError("Output is larger than the 4 GiB a classic TIFF can address")
+        self.file.write(struct.pack("<H", len(entries)) + b"".join(entries) + struct.pack("<I", 0))
+        self.file.seek(4)
+        self.file.write(struct.pack("<I", directory))
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.file.close()
+
+    def abort(self):
+        """Close and delete the partial file"""
+        self.file.close()
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def _align(self):
+        if self.file.tell() % 2:
+            self.file.write(b"\0")
@@ -0,0 +1,236 @@
+"""Detect images that finished arriving in the RAW inbox.
+
+Uses inotify on Linux (through libc, no extra dependency) and falls back to
+polling the directory elsewhere. Either way a file is only reported once its
+size and modification time have stayed unchanged for settle_seconds, so
+partially-copied uploads are never handed to the engine, and only when its
+content sniffs as a supported image. Hidden files are ignored. With recursive,
+subfolders are watched too (inotify watches are added as folders appear) and
+names are reported relative to the inbox, e.g. "2024/shoot/a.jpg".
+
+inotify events can be lost: the kernel drops them when its queue overflows
+(say while a burst of uploads waits on the pipeline) and says so once. The
+inbox is rescanned on that signal and every reconcile_interval seconds anyway,
+so inotify mode never misses a file the polling fallback would find.
+"""
+import os
+import sys
+import time
+import select
+import struct
+import ctypes
+import ctypes.util
+
+from discovery import in_shard, sniff_format
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class _Inotify:
+    """Minimal inotify binding: watched directories, non-blocking reads of the entries that arrived in them"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._folders = {}   # watch descriptor -> folder relative to the inbox ("" for the inbox itself)
+
+    def add(self, path, folder="", subfolders=False):
+        """Watch path, reporting its entries under folder; with subfolders, new folders are reported too"""
+        mask = IN_CLOSE_WRITE | IN_MOVED_TO | (IN_CREATE if subfolders else 0)
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch failed for {path}")
+        self._folders[wd] = folder
+
+    def read(self, timeout):
+        """Wait up to timeout seconds and return ([(name, is_folder)] for what was written, moved in or
+        created, overflowed); overflowed means events were dropped and the names are incomplete"""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return [], False
+
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+
+        names = []
+        overflowed = False
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflowed = True
+                continue
+            if mask & IN_IGNORED:
+                # The folder was removed or moved away
+                self._folders.pop(wd, None)
+                continue
+            folder = self._folders.get(wd)
+            if name and folder is not None:
+                name = os.fsdecode(name)
+                names.append((os.path.join(folder, name) if folder else name, bool(mask & IN_ISDIR)))
+        return names, overflowed
+
+    def close(self):
+        os.close(self.fd)
+
+
+class InboxWatcher:
+    """Report each settled image in a directory once, until it is marked done.
+
+    With shard (index, count) only the names in that shard are reported, so
+    several watchers can split one inbox. With recursive, subfolders are watched
+    too, except hidden ones and those in exclude (an output or archive folder
+    nested inside the inbox).
+    """
+
+    def __init__(self, directory, settle_seconds=2.0, poll_interval=1.0, use_inotify=True, shard=None,
+                 recursive=False, exclude=(), reconcile_interval=60.0):
+        self.directory = directory
+        self.reconcile_interval = reconcile_interval
+        self.shard = shard
+        self.recursive = recursive
+        self.excluded = {os.path.realpath(path) for path in exclude}
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.use_inotify = use_inotify and sys.platform.startswith('linux')
+        self.backend = None
+
+        self._pending = {}   # name -> (signature, time the signature last changed)
+        self._emitted = set()
+        self._failed = {}    # name -> signature it failed with; retried once it changes
+
+    def _signature(self, name):
+        try:
+            stat = os.stat(os.path.join(self.directory, name))
+        except OSError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _consider(self, name, now):
+        if name in self._emitted or name in self._pending:
+            return
+        if os.path.basename(name).startswith('.') or not in_shard(name, self.shard):
+            return
+        signature = self._signature(name)
+        if signature is None or self._failed.get(name) == signature:
+            return
+        self._failed.pop(name, None)
+        self._pending[name] = (signature, now)
+
+    def _watched_folder(self, entry):
+        """Whether a subfolder entry is walked: not hidden, not a symlink, not excluded"""
+        return (not entry.name.startswith('.') and entry.is_dir(follow_symlinks=False)
+                and os.path.realpath(entry.path) not in self.excluded)
+
+    def _scan(self, now, folder="", inotify=None):
+        """Consider every file in folder (and, when recursive, below it); with inotify, watch new subfolders"""
+        pending = [folder]
+        while pending:
+            folder = pending.pop()
+            path = os.path.join(self.directory, folder)
+            if inotify and folder:
+                try:
+                    # Watch before listing, so nothing arriving in between is missed
+                    inotify.add(path, folder, subfolders=True)
+                except OSError:
+                    # Gone already, or out of inotify watches; its current files are still taken below
+                    pass
+            try:
+                with os.scandir(path) as entries:
+                    for entry in entries:
+                        name = os.path.join(folder, entry.name) if folder else entry.name
+                        if entry.is_file():
+                            self._consider(name, now)
+                        elif self.recursive and self._watched_folder(entry):
+                            pending.append(name)
+            except OSError:
+                # Removed or renamed while being walked
+                continue
+
+    def _settled(self, now):
+        """Pop pending files whose size and mtime held still for settle_seconds"""
+        ready = []
+        for name, (signature, changed_at) in list(self._pending.items()):
+            current = self._signature(name)
+            if current is None:
+                del self._pending[name]
+            elif current != signature:
+                self._pending[name] = (current, now)
+            elif now - changed_at >= self.settle_seconds:
+                del self._pending[name]
+                if sniff_format(os.path.join(self.directory, name)) is None:
+                    # Not an image; ignored until its content changes
+                    self._failed[name] = signature
+                    continue
+                self._emitted.add(name)
+                ready.append(name)
+        return ready
+
+    def done(self, name, failed=False):
+        """Forget a reported file; failed files are skipped until their content changes"""
+        self._emitted.discard(name)
+        if failed:
+            signature = self._signature(name)
+            if signature is not None:
+                self._failed[name] = signature
+
+    def run(self, emit, stop_event):
+        """Call emit(name) for every settled file until stop_event is set"""
+        inotify = None
+        if self.use_inotify:
+            try:
+                inotify = _Inotify()
+                inotify.add(self.directory, subfolders=self.recursive)
+            except (OSError, AttributeError):
+                if inotify:
+                    inotify.close()
+                inotify = None
+        self.backend = "inotify" if inotify else "polling"
+
+        try:
+            self._scan(time.monotonic(), inotify=inotify)
+            last_scan = time.monotonic()
+            while not stop_event.is_set():
+                if inotify:
+                    names, overflowed = inotify.read(self.poll_interval)
+                    now = time.monotonic()
+                    if overflowed or now - last_scan >= self.reconcile_interval:
+                        # Dropped events, or the periodic backstop: take whatever the events missed
+                        self._scan(now, inotify=inotify)
+                        last_scan = now
+                    for name, is_folder in names:
+                        if is_folder:
+                            # A new subfolder (created, or moved in with its files): watch and take its contents
+                            entry_path = os.path.join(self.directory, name)
+                            if (self.recursive and not os.path.basename(name).startswith('.')
+                                    and os.path.realpath(entry_path) not in self.excluded):
+                                self._scan(now, name, inotify)
+                            continue
+                        # A rewrite of a failed or in-flight file re-arms it
+                        self._failed.pop(name, None)
+                        self._consider(name, now)
+                else:
+                    stop_event.wait(self.poll_interval)
+                    now = time.monotonic()
+                    self._scan(now)
+
+                for name in self._settled(now):
+                    if not emit(name):
+                        return
+        finally:
+            if inotify:
+                inotify.close()